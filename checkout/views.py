@@ -5,7 +5,8 @@ from django.urls import reverse_lazy
 from django.views.generic import edit
 from django.utils.translation import gettext_lazy as _
 
-from order.models import Order
+from order.cart import SessionCart, get_open_cart, set_cart_count
+from order.models import Reservation
 from .models import Address
 from .forms import CheckoutForm
 
@@ -27,24 +28,23 @@ class CheckoutView(edit.FormView):
         action = form.save(commit=False)
         if self.request.user.is_authenticated:
             action.user = self.request.user
+            order = get_open_cart(self.request).first()
+        else:
+            # Anonymous cart becomes an order only now
+            order = SessionCart(self.request).save_order()
+        if order is None:
+            messages.info(self.request, _("You do not have anything in cart"))
+            return redirect("core:home")
         action.save()
-        order = (
-            Order.objects.filter(
-                ordered=False,
-                user=(
-                    self.request.user if self.request.user.is_authenticated else None
-                ),
-                session_key=(
-                    None
-                    if self.request.user.is_authenticated
-                    else self.request.session.session_key
-                ),
-            )
-            .select_related("address")
-            .first()
-        )
         order.address = action
         order.save()
+        short = Reservation.objects.reserve(order)
+        if short:
+            messages.warning(
+                self.request,
+                _("Not enough on stock: ") + ", ".join(item.title for item in short),
+            )
+            return redirect("order:cart-summary")
         return super().form_valid(form)
 
     def get_initial(self):
@@ -88,23 +88,18 @@ class CheckoutView(edit.FormView):
                 "currency": "EUR",
             }
         )
+        if not self.request.user.is_authenticated:
+            order, order_items = SessionCart(self.request).get_order()
+            if order_items:
+                context["order"] = order
+                context["order_items"] = order_items
+            return context
         try:
             order = (
-                Order.objects.filter(
-                    ordered=False,
-                    user=(
-                        self.request.user
-                        if self.request.user.is_authenticated
-                        else None
-                    ),
-                    session_key=(
-                        None
-                        if self.request.user.is_authenticated
-                        else self.request.session.session_key
-                    ),
-                )
+                get_open_cart(self.request)
+                .with_totals()
                 .select_related("address")
-                .prefetch_related("orderitem_set")
+                .prefetch_related("orderitem_set__item")
                 .first()
             )
             order_items = order.orderitem_set.all()
@@ -114,6 +109,7 @@ class CheckoutView(edit.FormView):
                 if order.address:
                     context["order_has_address"] = True
         except AttributeError:
+            set_cart_count(self.request, 0)
             messages.info(self.request, _("You do not have anything in cart"))
             return redirect("core:home")
         return context
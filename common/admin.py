@@ -1,3 +1,27 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import ImageJob
+
+
+@admin.action(description="Retry selected jobs")
+def retry_jobs(modeladmin, request, queryset):  # pylint: disable=unused-argument
+    """Queue selected jobs again"""
+    for job in queryset:
+        job.retry()
+
+
+class ImageJobAdmin(admin.ModelAdmin):
+    list_display = [
+        "content_type",
+        "object_id",
+        "field_name",
+        "status",
+        "attempts",
+        "updated_date",
+    ]
+    list_filter = ["status"]
+    readonly_fields = ["error"]
+    actions = [retry_jobs]
+
+
+admin.site.register(ImageJob, ImageJobAdmin)
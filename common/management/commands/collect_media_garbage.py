@@ -0,0 +1,51 @@
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from common.storage import PREFIX, get_all_referenced
+
+
+def walk(storage, path):
+    """Names of all files below path"""
+    directories, files = storage.listdir(path)
+    for name in files:
+        yield f"{path}/{name}"
+    for directory in directories:
+        yield from walk(storage, f"{path}/{directory}")
+
+
+class Command(BaseCommand):
+    """Delete content-addressed media files nothing refers to"""
+
+    help = "Delete content-addressed media files no model refers to"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--grace",
+            type=int,
+            default=60,
+            help="Minutes new files are kept, they may be about to be referred to",
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Only report what would be deleted"
+        )
+
+    def handle(self, *args, **options):
+        if not default_storage.exists(PREFIX):
+            return
+        referenced = get_all_referenced()
+        cutoff = timezone.now() - timedelta(minutes=options["grace"])
+        count = size = 0
+        for name in walk(default_storage, PREFIX):
+            if name in referenced or default_storage.get_modified_time(name) > cutoff:
+                continue
+            count += 1
+            size += default_storage.size(name)
+            if not options["dry_run"]:
+                default_storage.delete(name)
+        action = "Would delete" if options["dry_run"] else "Deleted"
+        self.stdout.write(
+            self.style.SUCCESS(f"{action} {count} files, {size / 2**20:.1f} MB")
+        )
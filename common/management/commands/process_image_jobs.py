@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from common.models import process_image_jobs
+
+
+class Command(BaseCommand):
+    """Worker compressing uploaded images queued as ImageJob"""
+
+    help = "Compress queued images, polling for new jobs unless --once is given"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true", help="Exit when queue is empty"
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=2,
+            help="Seconds between polls of empty queue",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            done, failed = process_image_jobs()
+            if done or failed:
+                self.stdout.write(
+                    self.style.SUCCESS(f"Processed {done} images, {failed} failed")
+                )
+            if options["once"]:
+                break
+            time.sleep(options["interval"])
@@ -1,11 +1,21 @@
+import posixpath
+import tempfile
+from base64 import b64encode
 from io import BytesIO
-from datetime import date
+from datetime import date, timedelta
 
+from django.conf import settings
+from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.contenttypes.models import ContentType
 from django.core.files import File
+from django.core.files.base import ContentFile
+from django.db import models
+from django.dispatch import Signal
+from django.utils import timezone
+from django.utils.translation import gettext as _
 from PIL import Image, ImageOps
 from pillow_heif import register_heif_opener
 
-
 register_heif_opener()  #  HEIF/HEIC enable in Pillow
 
 
@@ -22,11 +32,325 @@ def carousel_image_path(instance, filename):
     return f"carousel/images/{instance.index}/{name}.webp"
 
 
-def compress(image):
-    """Image compression method and conversion to webp"""
+WEBP_QUALITY = 60
+# Written into EXIF of compressed images, tells which need encoding again
+ENCODER = f"eshop webp q{WEBP_QUALITY}"
+
+
+EXIF_ORIENTATION = 0x0112
+EXIF_SOFTWARE = 0x0131
+# Orientations rotating the image by 90 degrees
+ROTATED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def open_image(image, size):
+    """
+    Decode image downscaled to fit size and turned upright. Images with more
+    than settings.IMAGE_MAX_PIXELS are refused before decoding
+    """
     im = Image.open(image)  # pylint: disable=invalid-name
-    im = ImageOps.exif_transpose(im)  # pylint: disable=invalid-name
-    im_io = BytesIO()
-    im.save(im_io, format="webp", quality=60)
-    new_image = File(im_io, name=image.name)
+    # Only the header is read so far
+    if im.width * im.height > settings.IMAGE_MAX_PIXELS:
+        raise Image.DecompressionBombError(
+            f"Image of {im.width}x{im.height} pixels exceeds IMAGE_MAX_PIXELS"
+        )
+    if im.getexif().get(EXIF_ORIENTATION) in ROTATED_ORIENTATIONS:
+        size = size[::-1]
+    # Lets JPEG decode at 1/2 to 1/8 scale (draft) before resampling the rest
+    im.thumbnail(size, reducing_gap=3)
+    return ImageOps.exif_transpose(im)
+
+
+def compress(image):
+    """
+    Image compression method and conversion to webp.
+    Decodes downscaled to settings.IMAGE_MAX_DIMENSION and encodes into a
+    temporary file, so memory use does not grow with the upload
+    """
+    im = open_image(  # pylint: disable=invalid-name
+        image, (settings.IMAGE_MAX_DIMENSION, settings.IMAGE_MAX_DIMENSION)
+    )
+    exif = Image.Exif()
+    exif[EXIF_SOFTWARE] = ENCODER
+    spool = tempfile.TemporaryFile()
+    im.save(spool, format="webp", quality=WEBP_QUALITY, exif=exif)
+    spool.seek(0)
+    new_image = File(spool, name=image.name)
     return new_image
+
+
+def is_compressed(im):
+    """Whether opened image was written by compress with current quality"""
+    return im.format == "WEBP" and im.getexif().get(EXIF_SOFTWARE) == ENCODER
+
+
+RENDITION_WIDTHS = (320, 640, 1024, 1600)
+
+
+def rendition_name(name, width):
+    """Storage name of rendition of image name scaled to width"""
+    root, ext = posixpath.splitext(name)  # pylint: disable=unused-variable
+    return f"{root}_{width}w.webp"
+
+
+def get_rendition_widths(width, widths=RENDITION_WIDTHS):
+    """Widths of renditions made of an image width wide"""
+    return [rendition for rendition in widths if rendition < width]
+
+
+def make_renditions(storage, name, im, widths=RENDITION_WIDTHS):
+    """
+    Save downscaled webp copies of stored image name, decoded as im, next to it.
+    Returns manifest {width: storage name} including the image itself
+    """
+    manifest = {str(im.width): name}
+    for width in get_rendition_widths(im.width, widths):
+        height = max(1, round(im.height * width / im.width))
+        rendition = im.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=3)
+        im_io = BytesIO()
+        rendition.save(im_io, format="webp", quality=WEBP_QUALITY)
+        manifest[str(width)] = storage.save(
+            rendition_name(name, width), ContentFile(im_io.getvalue())
+        )
+    return manifest
+
+
+PLACEHOLDER_SIZE = 16
+
+
+def make_placeholder(im):
+    """
+    Size of image and a tiny blurry webp of it as data URI. Both are rendered
+    inline, so the page lays out and paints before the image is downloaded
+    """
+    placeholder = im.copy()
+    placeholder.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+    im_io = BytesIO()
+    placeholder.save(im_io, format="webp", quality=30)
+    return {
+        "width": im.width,
+        "height": im.height,
+        "data": f"data:image/webp;base64,{b64encode(im_io.getvalue()).decode()}",
+        # Placeholders of an earlier size are made again by reencode_images
+        "size": PLACEHOLDER_SIZE,
+    }
+
+
+# Sent with sender=model class and instance after a processed image is swapped in
+image_processed = Signal()
+
+
+def get_derived_field(model, field_name, kind):
+    """Name of field with data of kind derived from image field, None if model has none"""
+    derived_field = f"{field_name}_{kind}"
+    if any(field.name == derived_field for field in model._meta.fields):
+        return derived_field
+    return None
+
+
+def get_renditions_field(model, field_name):
+    """Name of renditions manifest field of image field, None if it has none"""
+    return get_derived_field(model, field_name, "renditions")
+
+
+def get_placeholder_field(model, field_name):
+    """Name of placeholder field of image field, None if it has none"""
+    return get_derived_field(model, field_name, "placeholder")
+
+
+def encode_image(model, field_name, name):
+    """
+    Compress stored image of model field into a new webp file next to it,
+    with renditions and placeholder if the model keeps them.
+    Returns field values of the encoded image
+    """
+    storage = model._meta.get_field(field_name).storage
+    with storage.open(name) as file, compress(file) as compressed:
+        new_name = storage.save(f"{posixpath.splitext(name)[0]}.webp", compressed)
+    return derive_images(model, field_name, new_name)
+
+
+def derive_images(model, field_name, name):
+    """
+    Renditions and placeholder of compressed stored image of model field, if
+    the model keeps them. Returns field values of the image
+    """
+    storage = model._meta.get_field(field_name).storage
+    values = {field_name: name}
+    renditions_field = get_renditions_field(model, field_name)
+    placeholder_field = get_placeholder_field(model, field_name)
+    if renditions_field or placeholder_field:
+        with storage.open(name) as file:
+            im = Image.open(file)  # pylint: disable=invalid-name
+            im.load()
+        if renditions_field:
+            values[renditions_field] = make_renditions(storage, name, im)
+        if placeholder_field:
+            values[placeholder_field] = make_placeholder(im)
+    return values
+
+
+def swap_image(instance, field_name, original, values):
+    """
+    Replace image original of instance by encoded values with a conditional
+    update, so an image replaced in the meantime is left alone. Files of the
+    losing side are left to collect_media_garbage, a concurrent upload of the
+    same content may refer to them. Returns whether image was swapped
+    """
+    model = type(instance)
+    swapped = model._default_manager.filter(
+        pk=instance.pk, **{field_name: original}
+    ).update(**values)
+    if swapped:
+        for field, value in values.items():
+            setattr(instance, field, value)
+        image_processed.send(sender=model, instance=instance)
+    return bool(swapped)
+
+
+def is_image_changed(old, new):
+    """Whether image field got a new file since init, also on creation"""
+    return bool(new) and (old != new or not new._committed)  # pylint: disable=W0212
+
+
+JOB_STATUS_CHOICES = (
+    ("P", _("Pending")),
+    ("R", _("Running")),
+    ("D", _("Done")),
+    ("F", _("Failed")),
+)
+
+
+class ImageJob(models.Model):
+    """
+    Compression of an uploaded image, run by the process_image_jobs worker
+    so saving a model with a big upload does not wait for it
+    """
+
+    PENDING, RUNNING, DONE, FAILED = "P", "R", "D", "F"
+    MAX_ATTEMPTS = 5
+    # Running jobs not finished after this were lost with their worker
+    STALE_AFTER = timedelta(minutes=10)
+
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveBigIntegerField()
+    content_object = GenericForeignKey("content_type", "object_id")
+    field_name = models.CharField(max_length=50)
+    # Stored name of the uploaded original
+    image_name = models.CharField(max_length=255)
+    status = models.CharField(
+        choices=JOB_STATUS_CHOICES,
+        max_length=1,
+        default=PENDING,
+        verbose_name=_("Status"),
+    )
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name=_("Attempts"))
+    error = models.TextField(blank=True, verbose_name=_("Error"))
+    run_after = models.DateTimeField(default=timezone.now, verbose_name=_("Run after"))
+    created_date = models.DateTimeField(
+        auto_now_add=True, verbose_name=_("Creation date")
+    )
+    updated_date = models.DateTimeField(auto_now=True, verbose_name=_("Update date"))
+
+    class Meta:
+        verbose_name = _("Image job")
+        verbose_name_plural = _("Image jobs")
+        indexes = [
+            models.Index(
+                fields=["status", "run_after"], name="common_imagejob_queue_idx"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.content_type.model} {self.object_id} {self.field_name}"
+
+    @classmethod
+    def enqueue(cls, instance, field_name):
+        """Queue compression of image field of saved instance"""
+        return cls.objects.create(
+            content_type=ContentType.objects.get_for_model(instance),
+            object_id=instance.pk,
+            field_name=field_name,
+            image_name=getattr(instance, field_name).name,
+        )
+
+    @classmethod
+    def get_runnable(cls):
+        """Due pending jobs and running jobs of lost workers"""
+        now = timezone.now()
+        return cls.objects.filter(
+            models.Q(status=cls.PENDING, run_after__lte=now)
+            | models.Q(status=cls.RUNNING, updated_date__lt=now - cls.STALE_AFTER)
+        )
+
+    @classmethod
+    def claim_next(cls):
+        """
+        Mark oldest runnable job as running and return it, None if queue is empty.
+        The conditional update lets only one of several workers claim a job
+        """
+        for pk in (
+            cls.get_runnable()
+            .order_by("run_after", "id")
+            .values_list("pk", flat=True)[:10]
+        ):
+            if (
+                cls.get_runnable()
+                .filter(pk=pk)
+                .update(
+                    status=cls.RUNNING,
+                    attempts=models.F("attempts") + 1,
+                    updated_date=timezone.now(),
+                )
+            ):
+                return cls.objects.get(pk=pk)
+        return None
+
+    def run(self):
+        """
+        Compress image and swap it in, unless it was replaced in the meantime.
+        The original is kept, collect_media_garbage deletes it once unreferenced
+        """
+        instance = self.content_object
+        image = getattr(instance, self.field_name, None)
+        if image and image.name == self.image_name:
+            values = encode_image(type(instance), self.field_name, image.name)
+            swap_image(instance, self.field_name, image.name, values)
+        self.status = self.DONE
+        self.error = ""
+        self.save(update_fields=["status", "error", "updated_date"])
+
+    def fail(self, error):
+        """Retry later with exponential backoff, give up after MAX_ATTEMPTS"""
+        self.error = str(error)
+        if self.attempts >= self.MAX_ATTEMPTS or isinstance(
+            error, Image.DecompressionBombError
+        ):
+            self.status = self.FAILED
+        else:
+            self.status = self.PENDING
+            self.run_after = timezone.now() + timedelta(minutes=2**self.attempts)
+        self.save(update_fields=["status", "error", "run_after", "updated_date"])
+
+    def retry(self):
+        """Queue failed job again"""
+        self.status = self.PENDING
+        self.attempts = 0
+        self.run_after = timezone.now()
+        self.save(update_fields=["status", "attempts", "run_after", "updated_date"])
+
+
+def process_image_jobs(limit=None):
+    """Run runnable image jobs until queue is empty, returns (done, failed)"""
+    done = failed = 0
+    while limit is None or done + failed < limit:
+        job = ImageJob.claim_next()
+        if job is None:
+            break
+        try:
+            job.run()
+            done += 1
+        except Exception as error:  # pylint: disable=broad-except
+            job.fail(error)
+            failed += 1
+    return done, failed
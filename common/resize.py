@@ -0,0 +1,147 @@
+"""
+Images resized on request, kept in a size-bounded disk cache.
+
+Variants are files named by hash of (path, size, format) below
+settings.RESIZE_CACHE_DIR. A hit touches the file, so modification times
+order variants by last use and eviction drops the least recently used ones
+once the cache outgrows settings.RESIZE_CACHE_MAX_SIZE. Only sizes of
+RENDITION_WIDTHS are rendered, so an image has a bounded number of variants.
+Only one request renders a missing variant; concurrent requests for it wait
+a short while for the file and then give up.
+"""
+
+import hashlib
+import os
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from PIL import Image
+
+from .models import RENDITION_WIDTHS, WEBP_QUALITY, open_image
+
+FORMATS = {"avif": "image/avif", "webp": "image/webp"}
+QUALITY = {"avif": 50, "webp": WEBP_QUALITY}
+LOCK_KEY = "common:resize_lock:{key}"
+# Longest a render may hold the lock of its variant
+LOCK_TIMEOUT = 30
+# Longest a request waits for a variant another request renders
+WAIT_TIMEOUT = 2
+WAIT_INTERVAL = 0.05
+# Evicted down to this share of the maximum, so eviction does not run every write
+EVICT_TO = 0.9
+
+
+class ResizeBusy(Exception):
+    """Variant is still being rendered by another request"""
+
+
+def is_supported_size(width, height):
+    """Whether width x height is a size variants are rendered in"""
+    return width in RENDITION_WIDTHS and height in RENDITION_WIDTHS
+
+
+def get_format(accept):
+    """AVIF if client and Pillow support it, else WebP"""
+    Image.init()
+    if "image/avif" in accept and "AVIF" in Image.SAVE:
+        return "avif"
+    return "webp"
+
+
+class ResizeCache:
+    """Disk cache of resized variants with LRU eviction"""
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        # Bytes written by this process since the last size check
+        self.written = 0
+
+    def get_path(self, key, image_format):
+        """File of variant"""
+        return os.path.join(self.directory, key[:2], f"{key}.{image_format}")
+
+    def open(self, path, width, height, image_format):
+        """
+        Open file of stored image path resized to fit width x height,
+        rendering it on first request. Raises ResizeBusy if another request
+        renders it for longer than WAIT_TIMEOUT
+        """
+        key = hashlib.sha256(
+            f"{path}|{width}x{height}|{image_format}".encode()
+        ).hexdigest()
+        variant = self.get_path(key, image_format)
+        lock_key = LOCK_KEY.format(key=key)
+        deadline = time.monotonic() + WAIT_TIMEOUT
+        while True:
+            file = self.open_variant(variant)
+            if file is not None:
+                return file
+            if cache.add(lock_key, 1, LOCK_TIMEOUT):
+                break
+            if time.monotonic() > deadline:
+                raise ResizeBusy(path)
+            time.sleep(WAIT_INTERVAL)
+        try:
+            # Rendered by the request that held the lock just before
+            file = self.open_variant(variant)
+            if file is not None:
+                return file
+            self.render(path, (width, height), image_format, variant)
+        finally:
+            cache.delete(lock_key)
+        return open(variant, "rb")  # pylint: disable=consider-using-with
+
+    def open_variant(self, variant):
+        """Open variant file marked as most recently used, None if missing"""
+        try:
+            os.utime(variant)
+            return open(variant, "rb")  # pylint: disable=consider-using-with
+        except FileNotFoundError:
+            return None
+
+    def render(self, path, size, image_format, variant):
+        """Resize and encode image into variant file, written atomically"""
+        with default_storage.open(path) as file:
+            im = open_image(file, size)  # pylint: disable=invalid-name
+        os.makedirs(os.path.dirname(variant), exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(variant), suffix=".tmp", delete=False
+        ) as temporary:
+            im.save(temporary, format=image_format, quality=QUALITY[image_format])
+        os.replace(temporary.name, variant)
+        self.written += os.path.getsize(variant)
+        if self.written > self.max_size * (1 - EVICT_TO):
+            self.evict()
+
+    def evict(self):
+        """Delete least recently used variants until cache fits EVICT_TO of maximum"""
+        self.written = 0
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".tmp"):  # Being written
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except FileNotFoundError:  # Evicted by another process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_size:
+            return
+        entries.sort()
+        for _, size, variant in entries:
+            if total <= self.max_size * EVICT_TO:
+                break
+            try:
+                os.remove(variant)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+resize_cache = ResizeCache(settings.RESIZE_CACHE_DIR, settings.RESIZE_CACHE_MAX_SIZE)
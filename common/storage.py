@@ -0,0 +1,78 @@
+"""
+Content-addressed media storage.
+
+Every file is stored once under the sha256 of its content, so the same photo
+uploaded for several items, or an item saved again, shares one file. A stored
+name never changes its content, which lets browsers and proxies cache media
+forever. Files are shared, so they are only deleted by collect_media_garbage,
+once no image field or renditions manifest has referred to them for a grace
+period. Saving content stored already touches its file, so a file about to
+be referred to again is not collected.
+"""
+
+import hashlib
+import os
+import posixpath
+import uuid
+
+from django.apps import apps
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import models
+
+PREFIX = "cas"
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """File system storage naming files by hash of their content"""
+
+    def save(self, name, content, max_length=None):
+        """Store content unless stored already, returns its content-addressed name"""
+        if name is None:
+            name = content.name
+        if not hasattr(content, "chunks"):
+            content = File(content, name)
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        ext = posixpath.splitext(name)[1].lower()
+        name = f"{PREFIX}/{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+        if self.exists(name):
+            os.utime(self.path(name))  # Grace period starts again
+            return name
+        return super().save(name, content, max_length)
+
+    def get_available_name(self, name, max_length=None):
+        # Equal names mean equal content, no need for a free name
+        return name
+
+    def _save(self, name, content):
+        # Write aside and rename, so concurrent writers of the same content
+        # never expose a half-written file
+        temporary = super()._save(f"{name}.{uuid.uuid4().hex}.tmp", content)
+        os.replace(self.path(temporary), self.path(name))
+        return name
+
+
+def get_file_fields():
+    """(model, file field name, renditions field name or None) of all models"""
+    from .models import get_renditions_field  # pylint: disable=import-outside-toplevel
+
+    for model in apps.get_models():
+        for field in model._meta.fields:
+            if isinstance(field, models.FileField):
+                yield model, field.name, get_renditions_field(model, field.name)
+
+
+def get_all_referenced():
+    """Every storage name referred to by a file field or renditions manifest"""
+    referenced = set()
+    for model, field_name, renditions_field in get_file_fields():
+        fields = [field_name] + ([renditions_field] if renditions_field else [])
+        for row in model._default_manager.values_list(*fields).iterator():
+            referenced.add(row[0])
+            if renditions_field and row[1]:
+                referenced.update(row[1].values())
+    referenced.discard("")
+    return referenced
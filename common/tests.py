@@ -1,3 +1,140 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+import threading
+import time
+from io import BytesIO
+from unittest.mock import patch
 
-# Create your tests here.
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from common.models import compress
+from common.resize import ResizeCache
+
+
+class CompressTestCase(TestCase):
+    """Testing bounded decoding of uploaded images"""
+
+    def upload(self, size, image_format="jpeg", orientation=None):
+        """Image file of size, optionally with EXIF orientation"""
+        im_io = BytesIO()
+        exif = Image.Exif()
+        if orientation:
+            exif[0x0112] = orientation
+        Image.new("RGB", size, "red").save(im_io, format=image_format, exif=exif)
+        im_io.seek(0)
+        im_io.name = f"upload.{image_format}"
+        return im_io
+
+    @override_settings(IMAGE_MAX_DIMENSION=1000)
+    def test_downscaled(self):
+        """Big image fits max dimension, EXIF rotation is applied"""
+        with compress(self.upload((4000, 3000), orientation=6)) as compressed:
+            im = Image.open(compressed)  # pylint: disable=invalid-name
+            self.assertEqual((im.format, im.size), ("WEBP", (750, 1000)))
+
+    def test_small_kept(self):
+        """Small image keeps its size"""
+        with compress(self.upload((640, 480), "png")) as compressed:
+            self.assertEqual(Image.open(compressed).size, (640, 480))
+
+    @override_settings(IMAGE_MAX_PIXELS=1000000)
+    def test_decompression_bomb(self):
+        """Image with too many pixels is refused before decoding"""
+        with self.assertRaises(Image.DecompressionBombError):
+            compress(self.upload((2000, 1000), "png"))
+
+
+class ResizeCacheTestCase(TestCase):
+    """Testing on-the-fly resized images"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings.enable()
+        self.name = default_storage.save("photo.png", self.upload((1200, 800)))
+        self.cache = ResizeCache(os.path.join(self.media_root, "resized"), 10**6)
+        return super().setUp()
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.media_root)
+        return super().tearDown()
+
+    def upload(self, size):
+        """png image file of size"""
+        im_io = BytesIO()
+        Image.new("RGB", size, "red").save(im_io, format="png")
+        return ContentFile(im_io.getvalue(), name="photo.png")
+
+    def test_endpoint(self):
+        """Image is resized to fit requested size, unsupported sizes are refused"""
+        url = reverse(
+            "resize-image", kwargs={"width": 320, "height": 320, "path": self.name}
+        )
+        with patch("common.views.resize_cache", self.cache):
+            response = self.client.get(url, HTTP_ACCEPT="image/webp")
+            self.assertEqual(response["Content-Type"], "image/webp")
+            self.assertIn("immutable", response["Cache-Control"])
+            im = Image.open(BytesIO(b"".join(response.streaming_content)))
+            self.assertEqual(im.size, (320, 213))
+            missing = url.replace(self.name, "cas/none.webp")
+            self.assertEqual(self.client.get(missing).status_code, 404)
+            for size in ("9999x320", "300x320"):
+                unsupported = url.replace("320x320", size)
+                self.assertEqual(self.client.get(unsupported).status_code, 404)
+
+    def test_busy(self):
+        """Request gives up waiting for a variant another request renders"""
+        url = reverse(
+            "resize-image", kwargs={"width": 320, "height": 320, "path": self.name}
+        )
+        with patch("common.views.resize_cache", self.cache), patch(
+            "common.resize.cache.add", return_value=False
+        ), patch("common.resize.WAIT_TIMEOUT", 0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "1")
+
+    def test_lru_eviction(self):
+        """Least recently used variant is evicted first"""
+        for width in (320, 640, 1024):
+            self.cache.open(self.name, width, width, "webp").close()
+        time.sleep(0.01)
+        self.cache.open(self.name, 320, 320, "webp").close()  # Used again
+        self.cache.max_size = self.cache.written - 1
+        self.cache.evict()
+        remaining = {
+            Image.open(os.path.join(root, name)).width
+            for root, _, files in os.walk(self.cache.directory)
+            for name in files
+        }
+        self.assertNotIn(640, remaining)
+        self.assertIn(320, remaining)
+
+    def test_stampede(self):
+        """Concurrent requests for a missing variant render it once"""
+        render = self.cache.render
+        renders = []
+
+        def slow_render(*args):
+            renders.append(args)
+            time.sleep(0.2)
+            render(*args)
+
+        with patch.object(self.cache, "render", slow_render):
+            threads = [
+                threading.Thread(
+                    target=lambda: self.cache.open(self.name, 50, 50, "webp").close()
+                )
+                for _ in range(4)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(renders), 1)
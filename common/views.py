@@ -1,3 +1,58 @@
-from django.shortcuts import render
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.static import serve
+from PIL import Image, UnidentifiedImageError
 
-# Create your views here.
+from .resize import (
+    FORMATS,
+    ResizeBusy,
+    get_format,
+    is_supported_size,
+    resize_cache,
+)
+from .storage import PREFIX
+
+# A year, the longest max-age caches are expected to honour
+IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+RESIZED_MAX_AGE = 60 * 60 * 24
+
+
+def serve_immutable_media(request, path):
+    """Serve content-addressed media, its content never changes under a name"""
+    response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    patch_cache_control(
+        response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True
+    )
+    return response
+
+
+def resize_image(request, width, height, path):
+    """Stored image path resized to fit width x height, as AVIF or WebP"""
+    width, height = int(width), int(height)
+    if not is_supported_size(width, height):
+        raise Http404("Unsupported size")
+    image_format = get_format(request.headers.get("Accept", ""))
+    try:
+        variant = resize_cache.open(path, width, height, image_format)
+    except ResizeBusy:
+        response = HttpResponse(status=503)
+        response["Retry-After"] = 1
+        return response
+    except (
+        FileNotFoundError,
+        SuspiciousFileOperation,
+        UnidentifiedImageError,
+        Image.DecompressionBombError,
+    ) as error:
+        raise Http404("Image not found") from error
+    response = FileResponse(variant, content_type=FORMATS[image_format])
+    patch_vary_headers(response, ["Accept"])
+    if path.startswith(f"{PREFIX}/"):
+        patch_cache_control(
+            response, public=True, max_age=IMMUTABLE_MAX_AGE, immutable=True
+        )
+    else:
+        patch_cache_control(response, public=True, max_age=RESIZED_MAX_AGE)
+    return response
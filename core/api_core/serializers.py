@@ -13,11 +13,13 @@ class ItemSerializer(serializers.HyperlinkedModelSerializer):
             "price",
             "delivery_price",
             "discount",
+            "final_price",
             "category",
             "stock",
             "description",
             "created_date",
         ]
+        read_only_fields = ["final_price"]
         extra_kwargs = {
             "title": {"required": True},
             "price": {"required": True},
@@ -36,4 +38,6 @@ class CategorySerializer(serializers.HyperlinkedModelSerializer):
         fields = [
             "name",
             "slug",
+            "item_count",
         ]
+        read_only_fields = ["item_count"]
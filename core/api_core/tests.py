@@ -104,3 +104,20 @@ class CoreAPITestCase(APITestCase):
         response = self.client.delete(reverse("item-detail", args=[1]))
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         self.assertEqual(0, Item.objects.all().count())
+
+    def test_filter_and_sort_by_price(self):
+        """Testing price range filter and price sorting of item list"""
+        Item.objects.create(
+            title="Doll",
+            price=50,
+            delivery_price=5,
+            category=self.category,
+            description="this is our new doll",
+        )
+        response = self.client.get(reverse("item-list"), {"sort": "price"})
+        self.assertEqual([item["title"] for item in response.json()], ["Doll", "Toy"])
+        self.assertEqual(response.json()[0]["final_price"], "55.00")
+        response = self.client.get(
+            reverse("item-list"), {"min_price": "60", "sort": "-price"}
+        )
+        self.assertEqual([item["title"] for item in response.json()], ["Toy"])
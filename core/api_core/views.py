@@ -2,7 +2,7 @@
 
 from rest_framework import viewsets, permissions
 from core.api_core.serializers import ItemSerializer, CategorySerializer
-from core.models import Item, CategoryItem
+from core.models import SORT_ORDERINGS, Item, CategoryItem
 
 
 class IsAdminOrReadOnly(permissions.IsAdminUser):
@@ -14,12 +14,26 @@ class IsAdminOrReadOnly(permissions.IsAdminUser):
 
 
 class ItemViewSet(viewsets.ModelViewSet):
-    """Item viewset, GET for everyone. UPDATE PATCH PUT DELETE only admin. Filter items.stock > 0"""
+    """
+    Item viewset, GET for everyone. UPDATE PATCH PUT DELETE only admin. Filter items.stock > 0.
+    List can be filtered by ?min_price= and ?max_price= and sorted by
+    ?sort=newest|price|-price|bestseller
+    """
 
     queryset = Item.objects.order_by("-created_date").filter(stock__gt=0)
     serializer_class = ItemSerializer
     permission_classes = [IsAdminOrReadOnly]
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action != "list":
+            return queryset
+        params = self.request.query_params
+        ordering = SORT_ORDERINGS.get(params.get("sort"), "-created_date")
+        return queryset.price_between(
+            params.get("min_price"), params.get("max_price")
+        ).order_by(ordering, "-id" if ordering.startswith("-") else "id")
+
 
 class CategoryViewSet(viewsets.ModelViewSet):
     """Category viewset, GET for everyone. UPDATE PATCH PUT DELETE only admin"""
@@ -0,0 +1,53 @@
+"""Caching of catalog and product pages"""
+
+import time
+
+from django.core.cache import cache
+
+CATALOG_VERSION_KEY = "core:catalog_version"
+RECOMMENDATIONS_VERSION_KEY = "core:recommendations_version"
+PRODUCT_KEY = "core:product:{slug}"
+PRODUCT_TIMEOUT = 60 * 60 * 24
+
+
+def _new_version():
+    # Time based, so a version evicted from cache never starts over at an old value
+    return int(time.time() * 1000)
+
+
+def get_catalog_version():
+    """Current version of catalog, part of every catalog fragment cache key"""
+    return cache.get_or_set(CATALOG_VERSION_KEY, _new_version, None)
+
+
+def bump_catalog_version():
+    """Invalidate every cached catalog fragment at once"""
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.set(CATALOG_VERSION_KEY, _new_version(), None)
+
+
+def get_recommendations_version():
+    """Version of related items, changes with every rebuild"""
+    return cache.get_or_set(RECOMMENDATIONS_VERSION_KEY, _new_version, None)
+
+
+def bump_recommendations_version():
+    """Mark related items as rebuilt"""
+    cache.set(RECOMMENDATIONS_VERSION_KEY, _new_version(), None)
+
+
+def get_product_key(slug):
+    """Cache key of assembled product page data"""
+    return PRODUCT_KEY.format(slug=slug)
+
+
+def invalidate_product(slug):
+    """Drop cached product, next product page view reads it again"""
+    cache.delete(get_product_key(slug))
+
+
+def invalidate_products(slugs):
+    """Drop cached products of all slugs at once"""
+    cache.delete_many([get_product_key(slug) for slug in slugs])
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from core.recommendations import TOP_K, build_recommendations
+
+
+class Command(BaseCommand):
+    """Rebuild "Customers also bought" recommendations, to be run periodically"""
+
+    help = "Rebuild related items from orders bought together"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--partitions",
+            type=int,
+            default=1,
+            help="Passes over the order lines, divides peak memory use",
+        )
+        parser.add_argument(
+            "--top-k", type=int, default=TOP_K, help="Related items kept per item"
+        )
+
+    def handle(self, *args, **options):
+        count = build_recommendations(options["partitions"], options["top_k"])
+        self.stdout.write(self.style.SUCCESS(f"Stored {count} related items"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Item
+from core.search import rebuild_index
+
+
+class Command(BaseCommand):
+    """Rebuild full-text search index of items, e.g. after bulk updates"""
+
+    help = "Rebuild full-text search index of items"
+
+    def handle(self, *args, **options):
+        count = rebuild_index(Item.objects.iterator())
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} items"))
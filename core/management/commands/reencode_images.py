@@ -0,0 +1,256 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from common.models import (
+    PLACEHOLDER_SIZE,
+    RENDITION_WIDTHS,
+    WEBP_QUALITY,
+    derive_images,
+    encode_image,
+    get_placeholder_field,
+    get_rendition_widths,
+    get_renditions_field,
+    is_compressed,
+    make_placeholder,
+    swap_image,
+)
+from core.cache import bump_catalog_version
+from core.models import Carousel, Item, ItemImage
+
+IMAGE_FIELDS = ((Item, "title_image"), (ItemImage, "image"), (Carousel, "img"))
+# Done images are forgotten when encoding settings change
+ENCODING = f"webp q{WEBP_QUALITY} {RENDITION_WIDTHS}"
+PROGRESS_EVERY = 50
+
+
+def file_hash(storage, name):
+    """sha256 of stored file"""
+    digest = hashlib.sha256()
+    with storage.open(name) as file:
+        for chunk in file.chunks():
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def reencode(label, field_name, name, done_hash, manifest):
+    """
+    Encode stored image again in a pool process, unless its content is
+    the one written by an earlier run. Images compressed with current quality
+    already only get renditions of missing widths, manifest is None for
+    models without renditions. Returns (field values, hash) or None
+    """
+    model = apps.get_model(label)
+    storage = model._meta.get_field(field_name).storage
+    if done_hash is not None and file_hash(storage, name) == done_hash:
+        return None
+    with storage.open(name) as file:
+        im = Image.open(file)  # pylint: disable=invalid-name
+        compressed, width = is_compressed(im), im.width
+    if not compressed:
+        values = encode_image(model, field_name, name)
+    # Encoding again with the same quality would only lose detail
+    elif manifest is None or set(manifest) == {
+        str(rendition) for rendition in get_rendition_widths(width) + [width]
+    }:
+        return None
+    else:
+        values = derive_images(model, field_name, name)
+    return values, file_hash(storage, values[field_name])
+
+
+def placeholder(label, field_name, name):
+    """Placeholder of stored image made in a pool process, the image is kept"""
+    storage = apps.get_model(label)._meta.get_field(field_name).storage
+    with storage.open(name) as file:
+        im = Image.open(file)  # pylint: disable=invalid-name
+        im.load()
+    return make_placeholder(im)
+
+
+def parse_line(line):
+    """JSON value of line, None for a line cut off by an interruption"""
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+class Checkpoint:
+    """
+    Hashes of images written by this command, kept in a file of JSON lines.
+    Every image is appended once swapped in, so resuming redoes none of them
+    """
+
+    def __init__(self, path, restart=False):
+        self.path = path
+        self.done = {}
+        self.file = None
+        if not restart and os.path.exists(path):
+            with open(path, encoding="utf-8") as file:
+                header = parse_line(file.readline())
+                if isinstance(header, dict) and header.get("encoding") == ENCODING:
+                    for entry in map(parse_line, file):
+                        if isinstance(entry, list):
+                            self.done[entry[0]] = entry[1]
+
+    def __enter__(self):
+        # Written again atomically first, drops a cut off last line
+        with open(f"{self.path}.tmp", "w", encoding="utf-8") as file:
+            file.write(json.dumps({"encoding": ENCODING}) + "\n")
+            for key, digest in self.done.items():
+                file.write(json.dumps([key, digest]) + "\n")
+        os.replace(f"{self.path}.tmp", self.path)
+        self.file = open(self.path, "a", encoding="utf-8")
+        return self
+
+    def __exit__(self, *exc_info):
+        self.file.close()
+
+    def add(self, key, digest):
+        """Record image written, flushed right away"""
+        self.done[key] = digest
+        self.file.write(json.dumps([key, digest]) + "\n")
+        self.file.flush()
+
+
+class Command(BaseCommand):
+    """
+    Re-encode item and carousel images with current settings in a process
+    pool, e.g. after changing quality or rendition sizes. Interrupted runs
+    resume where they stopped, images written by an earlier run or compressed
+    with current quality already are skipped.
+    Placeholders of an earlier PLACEHOLDER_SIZE are then made from the stored
+    images without encoding them again
+    """
+
+    help = "Re-encode item and carousel images with current webp settings"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Number of encoding processes",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            default=os.path.join(settings.BASE_DIR, "reencode_images.jsonl"),
+            help="Progress file, allows resuming",
+        )
+        parser.add_argument(
+            "--restart", action="store_true", help="Ignore progress of earlier runs"
+        )
+
+    def handle(self, *args, **options):
+        self.encoded = self.skipped = self.failed = self.placeholders = 0
+        self.started = time.monotonic()
+        workers = max(1, options["workers"])
+
+        with Checkpoint(options["checkpoint"], options["restart"]) as checkpoint:
+            with ProcessPoolExecutor(workers, initializer=django.setup) as pool:
+                self.encode_images(pool, workers, checkpoint)
+                self.make_placeholders(pool, workers)
+
+        bump_catalog_version()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Encoded {self.encoded}, skipped {self.skipped}, "
+                f"failed {self.failed} images, {self.get_rate():.1f} images/s, "
+                f"made {self.placeholders} placeholders"
+            )
+        )
+
+    def encode_images(self, pool, workers, checkpoint):
+        """Encode images again unless done already"""
+        running = {}
+        for model, field_name in IMAGE_FIELDS:
+            renditions_field = get_renditions_field(model, field_name)
+            for instance in model.objects.exclude(**{field_name: ""}).iterator():
+                key = f"{model._meta.label_lower}:{instance.pk}:{field_name}"
+                name = getattr(instance, field_name).name
+                manifest = (
+                    getattr(instance, renditions_field) if renditions_field else None
+                )
+                future = pool.submit(
+                    reencode,
+                    model._meta.label_lower,
+                    field_name,
+                    name,
+                    checkpoint.done.get(key),
+                    manifest,
+                )
+                running[future] = (instance, field_name, key, name)
+                # Bounded number of rows in flight keeps memory flat
+                if len(running) >= workers * 2:
+                    self.collect(running, checkpoint, FIRST_COMPLETED)
+        self.collect(running, checkpoint)
+
+    def make_placeholders(self, pool, workers):
+        """Make placeholders of an earlier size again from stored images"""
+        running = {}
+        for model, field_name in IMAGE_FIELDS:
+            placeholder_field = get_placeholder_field(model, field_name)
+            if placeholder_field is None:
+                continue
+            for instance in model.objects.exclude(**{field_name: ""}).iterator():
+                if getattr(instance, placeholder_field).get("size") == PLACEHOLDER_SIZE:
+                    continue
+                name = getattr(instance, field_name).name
+                future = pool.submit(
+                    placeholder, model._meta.label_lower, field_name, name
+                )
+                running[future] = (instance, field_name, placeholder_field, name)
+                if len(running) >= workers * 2:
+                    self.collect_placeholders(running, FIRST_COMPLETED)
+        self.collect_placeholders(running)
+
+    def get_rate(self):
+        """Handled images per second"""
+        handled = self.encoded + self.skipped + self.failed
+        return handled / max(time.monotonic() - self.started, 1e-6)
+
+    def collect(self, running, checkpoint, return_when="ALL_COMPLETED"):
+        """Swap in results of finished futures and record them in checkpoint"""
+        finished, _ = wait(running, return_when=return_when)
+        for future in finished:
+            instance, field_name, key, name = running.pop(future)
+            try:
+                result = future.result()
+            except Exception as error:  # pylint: disable=broad-except
+                self.failed += 1
+                self.stderr.write(f"Failed {name}: {error}")
+                continue
+            if result is None:
+                self.skipped += 1
+                continue
+            values, digest = result
+            if swap_image(instance, field_name, name, values):
+                checkpoint.add(key, digest)
+            self.encoded += 1
+            if self.encoded % PROGRESS_EVERY == 0:
+                self.stdout.write(
+                    f"{self.encoded} images encoded, {self.get_rate():.1f} images/s"
+                )
+
+    def collect_placeholders(self, running, return_when="ALL_COMPLETED"):
+        """Store placeholders of finished futures, unless image was replaced"""
+        finished, _ = wait(running, return_when=return_when)
+        for future in finished:
+            instance, field_name, placeholder_field, name = running.pop(future)
+            try:
+                value = future.result()
+            except Exception as error:  # pylint: disable=broad-except
+                self.failed += 1
+                self.stderr.write(f"Failed placeholder of {name}: {error}")
+                continue
+            if swap_image(instance, field_name, name, {placeholder_field: value}):
+                self.placeholders += 1
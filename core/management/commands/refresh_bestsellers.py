@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from core.ranking import HALF_LIFE_DAYS, refresh_bestseller_scores
+
+
+class Command(BaseCommand):
+    """Recompute time-decayed bestseller scores, to be run periodically"""
+
+    help = "Recompute time-decayed bestseller scores of items"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--half-life",
+            type=float,
+            default=HALF_LIFE_DAYS,
+            help="Days after which a sale counts half",
+        )
+
+    def handle(self, *args, **options):
+        count = refresh_bestseller_scores(options["half_life"])
+        self.stdout.write(self.style.SUCCESS(f"Ranked {count} items"))
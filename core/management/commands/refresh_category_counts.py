@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from core.models import CategoryItem
+
+
+class Command(BaseCommand):
+    """Recount items on stock per category, e.g. after bulk updates"""
+
+    help = "Recount items on stock per category"
+
+    def handle(self, *args, **options):
+        CategoryItem.refresh_item_counts()
+        self.stdout.write(self.style.SUCCESS("Category item counts refreshed"))
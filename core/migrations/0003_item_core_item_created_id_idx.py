@@ -0,0 +1,17 @@
+# Generated by Django 4.0.6 on 2026-10-18 10:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_alter_carousel_options_alter_categoryitem_options'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['-created_date', '-id'], name='core_item_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,79 @@
+import unicodedata
+
+from django.db import migrations
+
+# DDL and text folding of core.search as of this migration, copied so later
+# changes of the app code do not change what this migration does
+SEARCH_TABLE = "core_item_search"
+UMLAUT_DIGRAPHS = (("ae", "a"), ("oe", "o"), ("ue", "u"))
+
+
+def normalize(text):
+    """Lowercase, replace ß, strip diacritics and fold umlaut digraphs"""
+    text = unicodedata.normalize("NFKD", (text or "").casefold().replace("ß", "ss"))
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    for digraph, letter in UMLAUT_DIGRAPHS:
+        text = text.replace(digraph, letter)
+    return text
+
+
+def create_search_index(apps, schema_editor):
+    """Create search table and index existing items"""
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {SEARCH_TABLE} "
+            "USING fts5(title, description, additional_information, "
+            "tokenize='trigram')"
+        )
+        insert = (
+            f"INSERT INTO {SEARCH_TABLE} "
+            "(rowid, title, description, additional_information) "
+            "VALUES (%s, %s, %s, %s)"
+        )
+    elif vendor == "postgresql":
+        schema_editor.execute(
+            f"CREATE TABLE {SEARCH_TABLE} "
+            "(item_id bigint PRIMARY KEY, document tsvector NOT NULL)"
+        )
+        schema_editor.execute(
+            f"CREATE INDEX {SEARCH_TABLE}_document_idx "
+            f"ON {SEARCH_TABLE} USING GIN (document)"
+        )
+        insert = (
+            f"INSERT INTO {SEARCH_TABLE} (item_id, document) "
+            "VALUES (%s, "
+            "setweight(to_tsvector('german', %s), 'A') || "
+            "setweight(to_tsvector('german', %s), 'B') || "
+            "setweight(to_tsvector('german', %s), 'C'))"
+        )
+    else:
+        return
+    Item = apps.get_model("core", "Item")  # pylint: disable=invalid-name
+    for item in Item.objects.using(schema_editor.connection.alias).iterator():
+        schema_editor.execute(
+            insert,
+            [
+                item.pk,
+                normalize(item.title),
+                normalize(item.description),
+                normalize(item.additional_information),
+            ],
+        )
+
+
+def drop_search_index(apps, schema_editor):  # pylint: disable=unused-argument
+    """Drop search table"""
+    if schema_editor.connection.vendor in ("sqlite", "postgresql"):
+        schema_editor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0003_item_core_item_created_id_idx"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
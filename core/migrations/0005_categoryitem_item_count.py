@@ -0,0 +1,38 @@
+# Generated by Django 4.0.6 on 2026-10-18 10:15
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_items(apps, schema_editor):
+    CategoryItem = apps.get_model("core", "CategoryItem")
+    Item = apps.get_model("core", "Item")
+    on_stock = (
+        Item.objects.filter(category=OuterRef("pk"), stock__gt=0)
+        .order_by()
+        .values("category")
+        .annotate(count=Count("pk"))
+        .values("count")
+    )
+    CategoryItem.objects.update(item_count=Coalesce(Subquery(on_stock), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_item_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='categoryitem',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Items on stock'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['category', 'stock'], name='core_item_category_idx'),
+        ),
+        migrations.RunPython(count_items, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.0.6 on 2026-10-18 10:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_categoryitem_item_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='bestseller_score',
+            field=models.FloatField(default=0, editable=False, verbose_name='Bestseller score'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['-bestseller_score'], name='core_item_bestseller_idx'),
+        ),
+    ]
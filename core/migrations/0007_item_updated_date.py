@@ -0,0 +1,18 @@
+# Generated by Django 4.0.6 on 2026-10-18 10:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_item_bestseller_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='updated_date',
+            field=models.DateTimeField(auto_now=True, verbose_name='Update date'),
+        ),
+    ]
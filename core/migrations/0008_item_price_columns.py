@@ -0,0 +1,51 @@
+# Generated by Django 4.0.6 on 2026-10-18 10:20
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_price_columns(apps, schema_editor):
+    Item = apps.get_model("core", "Item")
+    Item.objects.update(
+        final_price=F("price") + F("delivery_price") - F("discount"),
+        price_no_delivery=F("price") - F("discount"),
+        price_no_discount=F("price") + F("delivery_price"),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_item_updated_date'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='item',
+            name='core_item_bestseller_idx',
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='final_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10, verbose_name='Final price'),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='price_no_delivery',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10, verbose_name='Price without delivery'),
+        ),
+        migrations.AddField(
+            model_name='item',
+            name='price_no_discount',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10, verbose_name='Price without discount'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['-bestseller_score', '-id'], name='core_item_bestseller_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['final_price', 'id'], name='core_item_price_idx'),
+        ),
+        migrations.RunPython(fill_price_columns, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.0.6 on 2026-10-18 10:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_item_price_columns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField(verbose_name='Score')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_items', to='core.item')),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.item')),
+            ],
+            options={
+                'verbose_name': 'Related item',
+                'verbose_name_plural': 'Related items',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='relateditem',
+            index=models.Index(fields=['item', '-score'], name='core_related_item_idx'),
+        ),
+    ]
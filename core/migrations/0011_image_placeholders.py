@@ -0,0 +1,28 @@
+# Generated by Django 4.0.6 on 2026-10-18 10:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0010_image_renditions"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="carousel",
+            name="img_placeholder",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name="item",
+            name="title_image_placeholder",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name="itemimage",
+            name="image_placeholder",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
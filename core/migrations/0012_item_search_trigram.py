@@ -0,0 +1,61 @@
+import unicodedata
+
+from django.db import migrations
+
+# DDL and text folding of core.search as of this migration, copied so later
+# changes of the app code do not change what this migration does
+SEARCH_TABLE = "core_item_search"
+UMLAUT_DIGRAPHS = (("ae", "a"), ("oe", "o"), ("ue", "u"))
+
+
+def normalize(text):
+    """Lowercase, replace ß, strip diacritics and fold umlaut digraphs"""
+    text = unicodedata.normalize("NFKD", (text or "").casefold().replace("ß", "ss"))
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    for digraph, letter in UMLAUT_DIGRAPHS:
+        text = text.replace(digraph, letter)
+    return text
+
+
+def add_trigram_index(apps, schema_editor):
+    """Add trigram indexed text on Postgres and fill it for existing items"""
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    schema_editor.execute(
+        f"ALTER TABLE {SEARCH_TABLE} "
+        "ADD COLUMN IF NOT EXISTS content text NOT NULL DEFAULT ''"
+    )
+    schema_editor.execute(
+        f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_content_idx "
+        f"ON {SEARCH_TABLE} USING GIN (content gin_trgm_ops)"
+    )
+    Item = apps.get_model("core", "Item")  # pylint: disable=invalid-name
+    for item in Item.objects.using(schema_editor.connection.alias).iterator():
+        content = " ".join(
+            normalize(text)
+            for text in (item.title, item.description, item.additional_information)
+        )
+        schema_editor.execute(
+            f"UPDATE {SEARCH_TABLE} SET content = %s WHERE item_id = %s",
+            [content, item.pk],
+        )
+
+
+def remove_trigram_index(apps, schema_editor):  # pylint: disable=unused-argument
+    """Drop trigram indexed text, its index goes with it"""
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(
+            f"ALTER TABLE {SEARCH_TABLE} DROP COLUMN IF EXISTS content"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0011_image_placeholders"),
+    ]
+
+    operations = [
+        migrations.RunPython(add_trigram_index, remove_trigram_index),
+    ]
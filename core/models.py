@@ -1,26 +1,56 @@
 """Core models: Item, CategoryItem, Carousel"""
 
+from decimal import Decimal, InvalidOperation
 from functools import cached_property
 from autoslug import AutoSlugField
 from django.db import models
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.query import ValuesListIterable
+from django.db.models.functions import Coalesce
+from django.dispatch import receiver
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.translation import gettext as _
 from embed_video.fields import EmbedVideoField
 
-from common.models import carousel_image_path, compress, item_image_path
-
+from common.models import (
+    ImageJob,
+    carousel_image_path,
+    image_processed,
+    is_image_changed,
+    item_image_path,
+)
+from .cache import bump_catalog_version, invalidate_product, invalidate_products
+from .search import index_item, unindex_item
+from .typeahead import title_index
 
 LABEL_CHOICES = (
     ("n", "NEW"),
     ("h", "HOT"),
 )
 
+PRICE_FIELDS = {"price", "delivery_price", "discount"}
+PRICE_COLUMNS = {"final_price", "price_no_delivery", "price_no_discount"}
+# Fields of Item.get_facet(), as passed to update() and as deferred attributes
+FACET_FIELDS = {"category", "category_id", "stock"}
+
+# Sort options of item listings: query parameter value -> ordering
+SORT_ORDERINGS = {
+    "newest": "-created_date",
+    "price": "final_price",
+    "-price": "-final_price",
+    "bestseller": "-bestseller_score",
+}
+
 
 class CategoryItem(models.Model):
     """Category for items"""
 
     name = models.CharField(max_length=20)
     slug = AutoSlugField(populate_from="name", unique_with="id")
+    item_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name=_("Items on stock")
+    )
 
     def __str__(self):
         return str(self.name)
@@ -29,6 +59,137 @@ class CategoryItem(models.Model):
         verbose_name = _("Item category")
         verbose_name_plural = _("Item categories")
 
+    @classmethod
+    def refresh_item_counts(cls, category_ids=None):
+        """Recount items on stock for given categories, all if category_ids is None"""
+        on_stock = (
+            Item.objects.filter(category=OuterRef("pk"), stock__gt=0)
+            .order_by()
+            .values("category")
+            .annotate(count=Count("pk"))
+            .values("count")
+        )
+        categories = cls.objects.all()
+        if category_ids is not None:
+            categories = categories.filter(pk__in=category_ids)
+        categories.update(item_count=Coalesce(Subquery(on_stock), 0))
+        bump_catalog_version()
+
+
+class ItemCard:
+    """
+    Lightweight item for listings: only what a product card shows,
+    with prices precomputed. Built by Item.objects.cards()
+    """
+
+    __slots__ = (
+        "id",
+        "title",
+        "slug",
+        "title_image",
+        "title_image_renditions",
+        "title_image_placeholder",
+        "label",
+        "stock",
+        "discount",
+        "final_price",
+        "price_no_discount",
+        "created_date",
+        "bestseller_score",
+    )
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __eq__(self, other):
+        return isinstance(other, ItemCard) and self.id == other.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __str__(self):
+        return str(self.title)
+
+    @property
+    def pk(self):  # pylint: disable=invalid-name
+        """Primary key, like on model instances"""
+        return self.id
+
+    def get_label_display(self):
+        """Label name"""
+        return dict(LABEL_CHOICES).get(self.label)
+
+    def get_absolute_url(self):
+        """Absolute URL to item"""
+        return reverse("core:product", kwargs={"slug": self.slug})
+
+
+class ItemCardIterable(ValuesListIterable):
+    """Yield ItemCard for every row of values_list"""
+
+    def __iter__(self):
+        for row in super().__iter__():
+            yield ItemCard(*row)
+
+
+class ItemQuerySet(models.QuerySet):
+    """Item queryset keeping denormalized price columns in sync"""
+
+    def update(self, **kwargs):
+        """
+        Bulk update, recomputing price columns in the same statement
+        if price, delivery price or discount change. Invalidates cached catalog
+        and products, and on stock or category changes category counts.
+        bulk_update() runs through here too
+        """
+        changed = list(self.values_list("slug", "category"))
+        if PRICE_FIELDS & kwargs.keys():
+            price = kwargs.get("price", F("price"))
+            delivery_price = kwargs.get("delivery_price", F("delivery_price"))
+            discount = kwargs.get("discount", F("discount"))
+            kwargs.update(
+                final_price=price + delivery_price - discount,
+                price_no_delivery=price - discount,
+                price_no_discount=price + delivery_price,
+            )
+        rows = super().update(**kwargs)
+        bump_catalog_version()
+        invalidate_products(slug for slug, _ in changed)
+        if FACET_FIELDS & kwargs.keys():
+            # Items moved to another category may come from any category
+            CategoryItem.refresh_item_counts(
+                None
+                if {"category", "category_id"} & kwargs.keys()
+                else {category for _, category in changed} - {None}
+            )
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """Bulk insert, computing price columns like save()"""
+        objs = list(objs)
+        for obj in objs:
+            obj.set_prices()
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def cards(self):
+        """Items as ItemCard, loading only the columns shown in listings"""
+        queryset = self.values_list(*ItemCard.__slots__)
+        queryset._iterable_class = ItemCardIterable  # pylint: disable=protected-access
+        return queryset
+
+    def price_between(self, min_price=None, max_price=None):
+        """Items with final price in range. Empty or invalid bounds are ignored"""
+        queryset = self
+        for lookup, bound in (("gte", min_price), ("lte", max_price)):
+            try:
+                bound = Decimal(str(bound))
+            except InvalidOperation:
+                continue
+            if bound.is_finite():
+                queryset = queryset.filter(**{f"final_price__{lookup}": bound})
+        return queryset
+
 
 class Item(models.Model):
     """Item model for creating new items for purchase"""
@@ -63,6 +224,10 @@ class Item(models.Model):
     title_image = models.ImageField(
         upload_to=item_image_path, verbose_name=_("Title image")
     )
+    # {width: storage name} of downscaled copies, see common.models.make_renditions
+    title_image_renditions = models.JSONField(default=dict, blank=True, editable=False)
+    # Size and inline preview shown until the image loads, see common.models.make_placeholder
+    title_image_placeholder = models.JSONField(default=dict, blank=True, editable=False)
     item_video = EmbedVideoField(verbose_name="Item video", blank=True)
     description = models.TextField(verbose_name=_("Description"))
     additional_information = models.TextField(
@@ -71,28 +236,93 @@ class Item(models.Model):
     created_date = models.DateTimeField(
         auto_now_add=True, verbose_name=_("Creation date")
     )
+    updated_date = models.DateTimeField(auto_now=True, verbose_name=_("Update date"))
     ordered_counter = models.PositiveIntegerField(
         default="0", verbose_name=_("Ordered counter")
     )
+    bestseller_score = models.FloatField(
+        default=0, editable=False, verbose_name=_("Bestseller score")
+    )
+    # Denormalized prices for filtering and sorting in SQL, maintained in save()
+    final_price = models.DecimalField(
+        decimal_places=2,
+        max_digits=10,
+        default=0,
+        editable=False,
+        verbose_name=_("Final price"),
+    )
+    price_no_delivery = models.DecimalField(
+        decimal_places=2,
+        max_digits=10,
+        default=0,
+        editable=False,
+        verbose_name=_("Price without delivery"),
+    )
+    price_no_discount = models.DecimalField(
+        decimal_places=2,
+        max_digits=10,
+        default=0,
+        editable=False,
+        verbose_name=_("Price without discount"),
+    )
+
+    objects = ItemQuerySet.as_manager()
 
     class Meta:
         verbose_name = _("Item")
         verbose_name_plural = _("Items")
+        indexes = [
+            models.Index(
+                fields=["-created_date", "-id"], name="core_item_created_id_idx"
+            ),
+            models.Index(fields=["category", "stock"], name="core_item_category_idx"),
+            models.Index(
+                fields=["-bestseller_score", "-id"], name="core_item_bestseller_idx"
+            ),
+            models.Index(fields=["final_price", "id"], name="core_item_price_idx"),
+        ]
 
     def __str__(self):
         return str(self.title)
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self._old_title_image = self.title_image
+        # Values save() and receivers compare against. Deferred fields are
+        # left out, None if so, reading them here costs a query per row
+        deferred = self.get_deferred_fields()
+        self._old_title_image = None if "title_image" in deferred else self.title_image
+        self._old_facet = None if FACET_FIELDS & deferred else self.get_facet()
+        self._old_title = None if "title" in deferred else self.title
+
+    def set_prices(self):
+        """Compute denormalized price columns from price, delivery and discount"""
+        self.final_price = self.price + self.delivery_price - self.discount
+        self.price_no_delivery = self.price - self.discount
+        self.price_no_discount = self.price + self.delivery_price
 
     def save(self, *args, **kwargs):
         """
-        Checking if the image has been changed. If changed, apply compression and converse to webp
+        Checking if the image has been changed. If changed, queue compression and conversion to webp.
+        Denormalized price columns are recomputed
         """
-        if self._old_title_image != self.title_image:
-            self.title_image = compress(self.title_image)
+        image_changed = "title_image" not in self.get_deferred_fields() and (
+            is_image_changed(self._old_title_image, self.title_image)
+        )
+        if image_changed:
+            self.title_image_renditions = {}
+            self.title_image_placeholder = {}
+        self.set_prices()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and PRICE_FIELDS & set(update_fields):
+            kwargs["update_fields"] = {*update_fields, *PRICE_COLUMNS}
         super().save(*args, **kwargs)
+        if image_changed:
+            ImageJob.enqueue(self, "title_image")
+        self._old_title_image = self.title_image
+
+    def get_facet(self):
+        """Category and whether item is on stock, as counted in CategoryItem.item_count"""
+        return self.category_id, int(self.stock or 0) > 0
 
     def get_absolute_url(self):
         """Absolute URL to item"""
@@ -131,6 +361,8 @@ class ItemImage(models.Model):
         on_delete=models.CASCADE,
     )
     image = models.ImageField(upload_to=item_image_path, verbose_name=_("Image"))
+    image_renditions = models.JSONField(default=dict, blank=True, editable=False)
+    image_placeholder = models.JSONField(default=dict, blank=True, editable=False)
 
     @property
     def slug(self):
@@ -145,19 +377,32 @@ class ItemImage(models.Model):
         super().__init__(*args, **kwargs)
         self._old_image = self.image
 
+    def set_prices(self):
+        """Compute denormalized price columns from price, delivery and discount"""
+        self.final_price = self.price + self.delivery_price - self.discount
+        self.price_no_delivery = self.price - self.discount
+        self.price_no_discount = self.price + self.delivery_price
+
     def save(self, *args, **kwargs):
         """
-        Checking if the image has been changed. If changed, apply compression and converse to webp
+        Checking if the image has been changed. If changed, queue compression and conversion to webp
         """
-        if self._old_image != self.image:
-            self.image = compress(self.image)
+        image_changed = is_image_changed(self._old_image, self.image)
+        if image_changed:
+            self.image_renditions = {}
+            self.image_placeholder = {}
         super().save(*args, **kwargs)
+        if image_changed:
+            ImageJob.enqueue(self, "image")
+        self._old_image = self.image
 
 
 class Carousel(models.Model):
     """Carousel on home page"""
 
     img = models.ImageField(upload_to=carousel_image_path)
+    img_renditions = models.JSONField(default=dict, blank=True, editable=False)
+    img_placeholder = models.JSONField(default=dict, blank=True, editable=False)
     title = models.CharField(max_length=120, verbose_name=_("Title"))
     body = models.TextField(verbose_name=_("Body text"))
     alt = models.TextField(verbose_name=_("Alt text"))
@@ -174,10 +419,147 @@ class Carousel(models.Model):
         super().__init__(*args, **kwargs)
         self._old_img = self.img
 
+    def set_prices(self):
+        """Compute denormalized price columns from price, delivery and discount"""
+        self.final_price = self.price + self.delivery_price - self.discount
+        self.price_no_delivery = self.price - self.discount
+        self.price_no_discount = self.price + self.delivery_price
+
     def save(self, *args, **kwargs):
         """
-        Checking if the image has been changed. If changed, apply compression and converse to webp
+        Checking if the image has been changed. If changed, queue compression and conversion to webp
         """
-        if self._old_img != self.img:
-            self.img = compress(self.img)
+        image_changed = is_image_changed(self._old_img, self.img)
+        if image_changed:
+            self.img_renditions = {}
+            self.img_placeholder = {}
         super().save(*args, **kwargs)
+        if image_changed:
+            ImageJob.enqueue(self, "img")
+        self._old_img = self.img
+
+
+class RelatedItem(models.Model):
+    """Item bought together with another item, built by build_recommendations"""
+
+    item = models.ForeignKey(
+        Item, related_name="related_items", on_delete=models.CASCADE
+    )
+    related = models.ForeignKey(Item, related_name="+", on_delete=models.CASCADE)
+    score = models.FloatField(verbose_name=_("Score"))
+
+    class Meta:
+        verbose_name = _("Related item")
+        verbose_name_plural = _("Related items")
+        indexes = [
+            models.Index(fields=["item", "-score"], name="core_related_item_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.item_id} -> {self.related_id}"
+
+
+@receiver(models.signals.post_save, sender=Item)
+def update_search_index(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """Keep search index in sync with saved item"""
+    index_item(instance)
+
+
+@receiver(models.signals.post_delete, sender=Item)
+def delete_from_search_index(
+    sender, instance, **kwargs
+):  # pylint: disable=unused-argument
+    """Remove deleted item from search index"""
+    unindex_item(instance.pk)
+
+
+@receiver(models.signals.post_save, sender=Item)
+def update_category_item_count(
+    sender, instance, created, **kwargs
+):  # pylint: disable=unused-argument
+    """Recount items of old and new category when category or stock changed"""
+    if FACET_FIELDS - {"category"} <= instance.get_deferred_fields():
+        return  # Neither loaded nor set, so unchanged
+    facet = instance.get_facet()
+    old_facet = instance._old_facet  # pylint: disable=protected-access
+    if old_facet is None and not created:
+        # Loaded deferred, the old category is unknown
+        CategoryItem.refresh_item_counts()
+    elif created or facet != old_facet:
+        CategoryItem.refresh_item_counts({facet[0], old_facet[0]} - {None})
+    instance._old_facet = facet  # pylint: disable=protected-access
+
+
+@receiver(models.signals.post_delete, sender=Item)
+def delete_from_category_item_count(
+    sender, instance, **kwargs
+):  # pylint: disable=unused-argument
+    """Recount items of category of deleted item"""
+    if instance.category_id is not None:
+        CategoryItem.refresh_item_counts([instance.category_id])
+
+
+@receiver(models.signals.post_save, sender=Item)
+@receiver(models.signals.post_delete, sender=Item)
+@receiver(models.signals.post_save, sender=CategoryItem)
+@receiver(models.signals.post_delete, sender=CategoryItem)
+@receiver(models.signals.post_save, sender=Carousel)
+@receiver(models.signals.post_delete, sender=Carousel)
+@receiver(image_processed, sender=Carousel)
+def invalidate_catalog_cache(sender, **kwargs):  # pylint: disable=unused-argument
+    """Drop cached home page fragments when catalog content changes"""
+    bump_catalog_version()
+
+
+@receiver(models.signals.post_save, sender=Item)
+@receiver(models.signals.post_delete, sender=Item)
+def invalidate_product_cache(
+    sender, instance, **kwargs
+):  # pylint: disable=unused-argument
+    """Drop cached product page data of item"""
+    invalidate_product(instance.slug)
+
+
+@receiver(models.signals.post_save, sender=CategoryItem)
+@receiver(models.signals.pre_delete, sender=CategoryItem)
+def invalidate_category_products(
+    sender, instance, **kwargs
+):  # pylint: disable=unused-argument
+    """Drop cached product page data of items showing renamed or deleted category"""
+    invalidate_products(
+        Item.objects.filter(category=instance).values_list("slug", flat=True)
+    )
+
+
+@receiver(image_processed, sender=Item)
+def touch_processed_item(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """New version of item when its compressed title image is swapped in"""
+    Item.objects.filter(pk=instance.pk).update(updated_date=timezone.now())
+
+
+@receiver(models.signals.post_save, sender=ItemImage)
+@receiver(models.signals.post_delete, sender=ItemImage)
+@receiver(image_processed, sender=ItemImage)
+def touch_item_of_image(sender, instance, **kwargs):  # pylint: disable=unused-argument
+    """New version of item when its images change"""
+    Item.objects.filter(pk=instance.item_id).update(updated_date=timezone.now())
+
+
+@receiver(models.signals.post_save, sender=Item)
+def update_title_index(
+    sender, instance, created, **kwargs
+):  # pylint: disable=unused-argument
+    """Keep typeahead index in sync with saved item"""
+    if "title" in instance.get_deferred_fields():
+        return
+    if created or instance.title != instance._old_title:  # pylint: disable=W0212
+        title_index.update(instance.pk, instance.title, instance.slug)
+    instance._old_title = instance.title  # pylint: disable=protected-access
+
+
+@receiver(models.signals.post_delete, sender=Item)
+def delete_from_title_index(
+    sender, instance, **kwargs
+):  # pylint: disable=unused-argument
+    """Remove deleted item from typeahead index"""
+    title_index.remove(instance.pk)
@@ -0,0 +1,118 @@
+"""Keyset (cursor) pagination for item listings"""
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+def encode_cursor(value, pk):
+    """Encode value of ordering field and id into URL safe cursor"""
+    raw = f"{value.isoformat() if hasattr(value, 'isoformat') else value}|{pk}"
+    return urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor, field):
+    """Decode cursor into (value, id). Returns None if cursor is invalid"""
+    try:
+        value, pk = urlsafe_b64decode(cursor.encode()).decode().rsplit("|", 1)
+        return field.to_python(value), int(pk)
+    except (BinasciiError, UnicodeError, ValueError, ValidationError):
+        return None
+
+
+class KeysetPage:
+    """One page of keyset paginated objects"""
+
+    def __init__(self, object_list, has_next, has_previous, ordering="-created_date"):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.field_name = ordering.lstrip("-")
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def get_cursor(self, obj):
+        """Cursor pointing at obj"""
+        return encode_cursor(getattr(obj, self.field_name), obj.pk)
+
+    @property
+    def next_cursor(self):
+        """Cursor pointing after the last object of page"""
+        if self.has_next and self.object_list:
+            return self.get_cursor(self.object_list[-1])
+        return None
+
+    @property
+    def previous_cursor(self):
+        """Cursor pointing before the first object of page"""
+        if self.has_previous and self.object_list:
+            return self.get_cursor(self.object_list[0])
+        return None
+
+
+class KeysetPaginator:
+    """
+    Paginate queryset over (ordering field, id), newest first by default.
+    Every page is a single indexed range query of per_page + 1 rows,
+    so the cost does not grow with the depth of the page
+    """
+
+    def __init__(self, queryset, per_page, ordering="-created_date"):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = ordering
+        self.descending = ordering.startswith("-")
+        self.field_name = ordering.lstrip("-")
+
+    def seek(self, cursor, forward):
+        """Rows after cursor in ordering direction, or before it if not forward"""
+        value, pk = cursor
+        lookup = "lt" if self.descending == forward else "gt"
+        return self.queryset.filter(
+            Q(**{f"{self.field_name}__{lookup}": value})
+            | Q(**{self.field_name: value, f"id__{lookup}": pk})
+        )
+
+    def get_order_by(self, forward):
+        """Order by ordering field and id, reversed if not forward"""
+        prefix = "-" if self.descending == forward else ""
+        return f"{prefix}{self.field_name}", f"{prefix}id"
+
+    def get_page(self, after=None, before=None):
+        """Page following cursor "after" or preceding cursor "before" """
+        field = self.queryset.model._meta.get_field(self.field_name)
+        after = decode_cursor(after, field) if after else None
+        before = decode_cursor(before, field) if before else None
+
+        if before is not None:
+            rows = list(
+                self.seek(before, forward=False).order_by(
+                    *self.get_order_by(forward=False)
+                )[: self.per_page + 1]
+            )
+            has_previous = len(rows) > self.per_page
+            rows = rows[: self.per_page]
+            rows.reverse()
+            return KeysetPage(
+                rows, has_next=True, has_previous=has_previous, ordering=self.ordering
+            )
+
+        queryset = self.queryset
+        if after is not None:
+            queryset = self.seek(after, forward=True)
+        rows = list(
+            queryset.order_by(*self.get_order_by(forward=True))[: self.per_page + 1]
+        )
+        has_next = len(rows) > self.per_page
+        return KeysetPage(
+            rows[: self.per_page],
+            has_next=has_next,
+            has_previous=after is not None,
+            ordering=self.ordering,
+        )
@@ -0,0 +1,50 @@
+"""Time-decayed bestseller ranking of items"""
+
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from order.models import OrderItem
+from .cache import bump_catalog_version
+from .models import Item
+
+HALF_LIFE_DAYS = 30
+# Sales older than this many half-lives add less than 0.4% of their quantity
+HORIZON_HALF_LIVES = 8
+
+
+def compute_scores(half_life_days=HALF_LIFE_DAYS, now=None):
+    """
+    Sum quantities of ordered items, each weighted by 0.5 ** (age / half life).
+    Returns dict of item id to score
+    """
+    now = now or timezone.now()
+    half_life = timedelta(days=half_life_days)
+    order_items = (
+        OrderItem.objects.filter(
+            order__ordered=True,
+            order__ordered_date__gte=now - half_life * HORIZON_HALF_LIVES,
+        )
+        .values_list("item_id", "quantity", "order__ordered_date")
+        .iterator()
+    )
+    scores = defaultdict(float)
+    for item_id, quantity, ordered_date in order_items:
+        scores[item_id] += quantity * 0.5 ** ((now - ordered_date) / half_life)
+    return scores
+
+
+def refresh_bestseller_scores(half_life_days=HALF_LIFE_DAYS, batch_size=500):
+    """Store freshly computed scores in Item.bestseller_score, returns items ranked"""
+    scores = compute_scores(half_life_days)
+    with transaction.atomic():
+        Item.objects.exclude(bestseller_score=0).update(bestseller_score=0)
+        Item.objects.bulk_update(
+            [Item(pk=pk, bestseller_score=score) for pk, score in scores.items()],
+            ["bestseller_score"],
+            batch_size=batch_size,
+        )
+    bump_catalog_version()
+    return len(scores)
@@ -0,0 +1,96 @@
+"""
+"Customers also bought" recommendations from item co-occurrence in orders.
+
+Order lines of ordered orders are streamed sorted by order, so only one
+basket is held at a time. Pair counts form a sparse item x item matrix kept
+as a dict of Counters per anchor item. With partitions > 1 every pass only
+keeps rows of anchor items with id % partitions == pass, which divides peak
+memory by the number of partitions at the cost of streaming the lines again.
+Only the top rows of every item are kept until they replace the stored ones.
+"""
+
+from collections import Counter, defaultdict
+from math import sqrt
+
+from django.db import transaction
+
+from order.models import OrderItem
+from .cache import bump_recommendations_version
+from .models import RelatedItem
+
+TOP_K = 8
+# Huge baskets (e.g. wholesale) say little about items belonging together
+MAX_BASKET = 50
+
+
+def iter_baskets(chunk_size=5000):
+    """Yield sets of item ids per ordered order"""
+    lines = (
+        OrderItem.objects.filter(order__ordered=True)
+        .order_by("order_id")
+        .values_list("order_id", "item_id")
+        .iterator(chunk_size=chunk_size)
+    )
+    current_order, basket = None, set()
+    for order_id, item_id in lines:
+        if order_id != current_order:
+            if basket:
+                yield basket
+            current_order, basket = order_id, set()
+        basket.add(item_id)
+    if basket:
+        yield basket
+
+
+def count_pairs(partition=0, partitions=1, max_basket=MAX_BASKET):
+    """
+    Co-occurrence counts of anchor items in partition and the number
+    of orders containing each item
+    """
+    pairs = defaultdict(Counter)
+    orders = Counter()
+    for basket in iter_baskets():
+        if len(basket) > max_basket:
+            continue
+        orders.update(basket)
+        for anchor in basket:
+            if anchor % partitions == partition:
+                row = pairs[anchor]
+                for other in basket:
+                    if other != anchor:
+                        row[other] += 1
+    return pairs, orders
+
+
+def top_related(pairs, orders, top_k=TOP_K):
+    """
+    Best top_k neighbours of every anchor by cosine similarity,
+    so items everybody buys do not crowd out the specific ones
+    """
+    for anchor, row in pairs.items():
+        scores = Counter(
+            {
+                other: count / sqrt(orders[anchor] * orders[other])
+                for other, count in row.items()
+            }
+        )
+        for other, score in scores.most_common(top_k):
+            yield RelatedItem(item_id=anchor, related_id=other, score=score)
+
+
+def build_recommendations(partitions=1, top_k=TOP_K, batch_size=1000):
+    """
+    Replace stored recommendations, returns number of rows written. Rows are
+    computed first, only swapping them in runs in a transaction, so the rebuild
+    holds neither locks nor a long transaction open while streaming lines
+    """
+    rows = []
+    for partition in range(partitions):
+        pairs, orders = count_pairs(partition, partitions)
+        rows.extend(top_related(pairs, orders, top_k))
+        del pairs
+    with transaction.atomic():
+        RelatedItem.objects.all().delete()
+        RelatedItem.objects.bulk_create(rows, batch_size=batch_size)
+    bump_recommendations_version()
+    return len(rows)
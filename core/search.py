@@ -0,0 +1,156 @@
+"""
+Full-text search over items.
+
+Items are kept in a separate inverted index table "core_item_search":
+SQLite FTS5 (trigram tokenizer, matches parts of German compound words)
+locally. On Postgres a GIN indexed tsvector ranks whole words and prefixes,
+and a pg_trgm indexed copy of the text finds parts of compound words, like
+"bahn" in "Eisenbahn". Text is folded the same way for indexing and
+querying, so "Küche", "Kueche" and "kuche" are equal. Other database
+vendors fall back to icontains lookups. The tables are created by
+migrations 0004 and 0012, which keep copies of the DDL as it was then.
+"""
+
+import re
+import unicodedata
+
+from django.db import connection
+from django.db.models import Q
+
+SEARCH_TABLE = "core_item_search"
+SEARCH_LIMIT = 48
+
+UMLAUT_DIGRAPHS = (("ae", "a"), ("oe", "o"), ("ue", "u"))
+TOKEN_RE = re.compile(r"\w+")
+
+
+def normalize(text):
+    """Lowercase, replace ß, strip diacritics and fold umlaut digraphs"""
+    text = unicodedata.normalize("NFKD", (text or "").casefold().replace("ß", "ss"))
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    for digraph, letter in UMLAUT_DIGRAPHS:
+        text = text.replace(digraph, letter)
+    return text
+
+
+def get_tokens(query):
+    """Normalized tokens of search query"""
+    return TOKEN_RE.findall(normalize(query))
+
+
+def index_item(item, using=connection):
+    """Insert or replace item in search index"""
+    fields = (
+        normalize(item.title),
+        normalize(item.description),
+        normalize(item.additional_information),
+    )
+    with using.cursor() as cursor:
+        if using.vendor == "sqlite":
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [item.pk])
+            cursor.execute(
+                f"INSERT INTO {SEARCH_TABLE} "
+                "(rowid, title, description, additional_information) "
+                "VALUES (%s, %s, %s, %s)",
+                [item.pk, *fields],
+            )
+        elif using.vendor == "postgresql":
+            cursor.execute(
+                f"INSERT INTO {SEARCH_TABLE} (item_id, document, content) "
+                "VALUES (%s, "
+                "setweight(to_tsvector('german', %s), 'A') || "
+                "setweight(to_tsvector('german', %s), 'B') || "
+                "setweight(to_tsvector('german', %s), 'C'), %s) "
+                "ON CONFLICT (item_id) DO UPDATE "
+                "SET document = EXCLUDED.document, content = EXCLUDED.content",
+                [item.pk, *fields, " ".join(fields)],
+            )
+
+
+def unindex_item(pk, using=connection):
+    """Remove item from search index"""
+    with using.cursor() as cursor:
+        if using.vendor == "sqlite":
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [pk])
+        elif using.vendor == "postgresql":
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE item_id = %s", [pk])
+
+
+def rebuild_index(items, using=connection):
+    """Drop all entries of search index and index items again"""
+    with using.cursor() as cursor:
+        if using.vendor in ("sqlite", "postgresql"):
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+    count = 0
+    for item in items:
+        index_item(item, using=using)
+        count += 1
+    return count
+
+
+def search_items(queryset, query, limit=SEARCH_LIMIT, offset=0):
+    """
+    Items of queryset matching query, most relevant first, limit of them after
+    skipping offset. Title matches weigh more than description and additional
+    information. Filters of queryset apply before the limit
+    """
+    tokens = get_tokens(query)
+    if not tokens:
+        return []
+    subquery, subquery_params = queryset.order_by().values("pk").query.sql_with_params()
+
+    if connection.vendor == "sqlite":
+        # Trigram tokenizer needs at least 3 characters for MATCH
+        if all(len(token) >= 3 for token in tokens):
+            sql = (
+                f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s "
+                f"AND rowid IN ({subquery}) "
+                f"ORDER BY bm25({SEARCH_TABLE}, 10.0, 2.0, 1.0), rowid DESC "
+                "LIMIT %s OFFSET %s"
+            )
+            params = [
+                " ".join(f'"{token}"' for token in tokens),
+                *subquery_params,
+                limit,
+                offset,
+            ]
+        else:
+            sql = (
+                f"SELECT rowid FROM {SEARCH_TABLE} WHERE "
+                + " AND ".join(["title LIKE %s"] * len(tokens))
+                + f" AND rowid IN ({subquery}) "
+                "ORDER BY rowid DESC LIMIT %s OFFSET %s"
+            )
+            params = [f"%{token}%" for token in tokens]
+            params += [*subquery_params, limit, offset]
+    elif connection.vendor == "postgresql":
+        # Substring matches rank below word matches, their rank is 0
+        sql = (
+            f"SELECT item_id FROM {SEARCH_TABLE}, to_tsquery('german', %s) query "
+            "WHERE (document @@ query OR content LIKE ALL (%s)) "
+            f"AND item_id IN ({subquery}) "
+            "ORDER BY ts_rank_cd(document, query) DESC, item_id DESC "
+            "LIMIT %s OFFSET %s"
+        )
+        params = [
+            " & ".join(f"{token}:*" for token in tokens),
+            [f"%{token}%" for token in tokens],
+            *subquery_params,
+            limit,
+            offset,
+        ]
+    else:
+        condition = Q()
+        for token in query.split():
+            condition &= (
+                Q(title__icontains=token)
+                | Q(description__icontains=token)
+                | Q(additional_information__icontains=token)
+            )
+        return list(queryset.filter(condition).order_by("-pk")[offset : offset + limit])
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        ranked_ids = [row[0] for row in cursor.fetchall()]
+    items = {item.pk: item for item in queryset.filter(pk__in=ranked_ids)}
+    return [items[pk] for pk in ranked_ids if pk in items]
@@ -0,0 +1,59 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from django.utils.html import format_html
+
+register = template.Library()
+
+CARD_SIZES = "(min-width: 992px) 255px, (min-width: 768px) 50vw, 100vw"
+
+
+def get_placeholder_attrs(placeholder):
+    """Size attributes and background painting placeholder until image loads"""
+    if not placeholder:
+        return ""
+    return format_html(
+        ' width="{}" height="{}"'
+        ' style="height: auto; background: url({}) center / cover no-repeat"',
+        placeholder["width"],
+        placeholder["height"],
+        placeholder["data"],
+    )
+
+
+@register.simple_tag
+def srcset(image, renditions, sizes=CARD_SIZES, placeholder=None):
+    """
+    src, srcset and sizes attributes of <img> for image and its renditions,
+    so browsers download the smallest copy filling the rendered width.
+    With a placeholder the <img> gets its size and a preview right away
+    """
+    name = getattr(image, "name", image)
+    url = getattr(image, "storage", default_storage).url
+    placeholder_attrs = get_placeholder_attrs(placeholder)
+    if not renditions:
+        return format_html('src="{}"{}', url(name), placeholder_attrs)
+    candidates = sorted(renditions.items(), key=lambda rendition: int(rendition[0]))
+    return format_html(
+        'src="{}" srcset="{}" sizes="{}"{}',
+        url(candidates[0][1]),
+        ", ".join(f"{url(path)} {width}w" for width, path in candidates),
+        sizes,
+        placeholder_attrs,
+    )
+
+
+@register.simple_tag
+def resized_url(image, width, height):
+    """
+    URL of image resized on request to fit width x height,
+    both out of common.models.RENDITION_WIDTHS
+    """
+    return reverse(
+        "resize-image",
+        kwargs={
+            "width": width,
+            "height": height,
+            "path": getattr(image, "name", image),
+        },
+    )
@@ -1,3 +1,700 @@
-from django.test import TestCase
+"""Core app testing"""
 
-# Create your tests here.
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.template import Context, Template
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from common.models import ImageJob, process_image_jobs
+from core.management.commands.reencode_images import Checkpoint
+from core.models import CategoryItem, Item, RelatedItem
+from core.pagination import KeysetPaginator
+from core.ranking import refresh_bestseller_scores
+from core.recommendations import build_recommendations, count_pairs
+from core.search import search_items
+from core.typeahead import CHANGE_KEY, TitleIndex, title_index
+from order.models import Order, OrderItem
+from PIL import Image
+
+
+class KeysetPaginationTestCase(TestCase):
+    """Testing keyset pagination of item listings"""
+
+    def setUp(self):
+        for index in range(5):
+            Item.objects.create(
+                title=f"Toy {index}",
+                price=100,
+                title_image=f"items/toy{index}.webp",
+                description="this is our new toy",
+            )
+        return super().setUp()
+
+    def test_walk_pages(self):
+        """Walking forward and back returns every item exactly once, newest first"""
+        paginator = KeysetPaginator(Item.objects.all(), per_page=2)
+        seen = []
+        page = paginator.get_page()
+        self.assertFalse(page.has_previous)
+        while True:
+            seen.extend(item.title for item in page)
+            if not page.has_next:
+                break
+            page = paginator.get_page(after=page.next_cursor)
+        self.assertEqual(seen, [f"Toy {index}" for index in reversed(range(5))])
+
+        previous = paginator.get_page(before=page.previous_cursor)
+        self.assertEqual([item.title for item in previous], ["Toy 2", "Toy 1"])
+
+    def test_walk_pages_by_price(self):
+        """Pages ordered by price continue after equal prices"""
+        Item.objects.filter(title__in=["Toy 0", "Toy 1"]).update(discount=10)
+        paginator = KeysetPaginator(
+            Item.objects.all(), per_page=2, ordering="final_price"
+        )
+        first = paginator.get_page()
+        second = paginator.get_page(after=first.next_cursor)
+        self.assertEqual([item.title for item in first], ["Toy 0", "Toy 1"])
+        self.assertEqual([item.title for item in second], ["Toy 2", "Toy 3"])
+
+    def test_bulk_price_columns(self):
+        """Price columns follow bulk_create() and bulk_update()"""
+        Item.objects.bulk_create(
+            [
+                Item(
+                    title="Doll",
+                    price=50,
+                    delivery_price=5,
+                    discount=10,
+                    title_image="items/doll.webp",
+                    description="this is our new doll",
+                )
+            ]
+        )
+        doll = Item.objects.get(title="Doll")
+        self.assertEqual(
+            (doll.final_price, doll.price_no_delivery, doll.price_no_discount),
+            (45, 40, 55),
+        )
+        doll.price = 80
+        Item.objects.bulk_update([doll], ["price"])
+        doll.refresh_from_db()
+        self.assertEqual(
+            (doll.final_price, doll.price_no_delivery, doll.price_no_discount),
+            (75, 70, 85),
+        )
+
+    def test_invalid_cursor(self):
+        """Invalid cursor falls back to first page"""
+        response = self.client.get(reverse("core:home"), {"after": "garbage"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["recently_added_items"]), 5)
+
+    def test_cards(self):
+        """Cards paginate like items and do not load description"""
+        with CaptureQueriesContext(connection) as queries:
+            page = KeysetPaginator(Item.objects.cards(), per_page=2).get_page()
+            cards = list(page)
+        self.assertNotIn("description", queries.captured_queries[0]["sql"])
+        self.assertEqual([card.title for card in cards], ["Toy 4", "Toy 3"])
+        self.assertEqual(cards[0].final_price, 100)
+        self.assertEqual(
+            cards[0].get_absolute_url(),
+            Item.objects.get(title="Toy 4").get_absolute_url(),
+        )
+        second = KeysetPaginator(Item.objects.cards(), per_page=2).get_page(
+            after=page.next_cursor
+        )
+        self.assertEqual([card.title for card in second], ["Toy 2", "Toy 1"])
+
+
+class SearchTestCase(TestCase):
+    """Testing full-text search of items"""
+
+    def setUp(self):
+        self.train = Item.objects.create(
+            title="Holzeisenbahn",
+            price=100,
+            title_image="items/train.webp",
+            description="Spielzeug für die Küche",
+        )
+        self.kitchen = Item.objects.create(
+            title="Kinderküche",
+            price=100,
+            title_image="items/kitchen.webp",
+            description="Passt zur Eisenbahn",
+        )
+        return super().setUp()
+
+    def test_compound_word(self):
+        """Part of compound word matches, title match ranks first"""
+        self.assertEqual(
+            search_items(Item.objects.all(), "Eisenbahn"), [self.train, self.kitchen]
+        )
+
+    def test_filtered(self):
+        """Filters of queryset apply before the limit"""
+        self.assertEqual(
+            search_items(Item.objects.filter(pk=self.kitchen.pk), "Eisenbahn", 1),
+            [self.kitchen],
+        )
+
+    @patch("core.views.SEARCH_LIMIT", 1)
+    def test_paged(self):
+        """Results beyond the limit are on further pages"""
+        cache.clear()
+        response = self.client.get(reverse("core:home"), {"search": "Eisenbahn"})
+        page = response.context["recently_added_items"]
+        self.assertEqual([item.pk for item in page], [self.train.pk])
+        self.assertIsNone(page.previous_page_url)
+
+        response = self.client.get(reverse("core:home") + page.next_page_url)
+        page = response.context["recently_added_items"]
+        self.assertEqual([item.pk for item in page], [self.kitchen.pk])
+        self.assertIsNone(page.next_page_url)
+        self.assertIn("offset=0", page.previous_page_url)
+
+    def test_umlauts(self):
+        """Umlauts and their digraphs are equal"""
+        for query in ("küche", "Kueche", "kuche"):
+            self.assertEqual(
+                search_items(Item.objects.all(), query), [self.kitchen, self.train]
+            )
+
+    def test_index_follows_changes(self):
+        """Saved and deleted items are reindexed"""
+        self.train.title = "Puppe"
+        self.train.save()
+        self.assertEqual(search_items(Item.objects.all(), "Puppe"), [self.train])
+        self.train.delete()
+        self.assertEqual(search_items(Item.objects.all(), "Puppe"), [])
+
+
+class CategoryItemCountTestCase(TestCase):
+    """Testing precomputed item counts of categories"""
+
+    def setUp(self):
+        self.toys = CategoryItem.objects.create(name="Toys")
+        self.books = CategoryItem.objects.create(name="Books")
+        self.item = Item.objects.create(
+            title="Toy",
+            price=100,
+            category=self.toys,
+            title_image="items/toy.webp",
+            description="this is our new toy",
+        )
+        return super().setUp()
+
+    def assertCounts(self, toys, books):  # pylint: disable=invalid-name
+        """Compare stored counts of both categories"""
+        self.toys.refresh_from_db()
+        self.books.refresh_from_db()
+        self.assertEqual((self.toys.item_count, self.books.item_count), (toys, books))
+
+    def test_counts_follow_item_changes(self):
+        """Counts follow creation, category and stock changes and deletion"""
+        self.assertCounts(1, 0)
+        self.item.category = self.books
+        self.item.save()
+        self.assertCounts(0, 1)
+        self.item.stock = 0
+        self.item.save()
+        self.assertCounts(0, 0)
+        self.item.stock = 2
+        self.item.save()
+        self.assertCounts(0, 1)
+        self.item.delete()
+        self.assertCounts(0, 0)
+
+    def test_deferred_items(self):
+        """Deferred items load without extra queries, changes are still counted"""
+        with self.assertNumQueries(1):
+            item = Item.objects.only("title").get()
+        item.stock = 0
+        item.save()
+        self.assertCounts(0, 0)
+
+    def test_counts_follow_bulk_update(self):
+        """Counts follow stock and category changed by queryset update"""
+        Item.objects.filter(pk=self.item.pk).update(stock=0)
+        self.assertCounts(0, 0)
+        Item.objects.filter(pk=self.item.pk).update(category=self.books, stock=3)
+        self.assertCounts(0, 1)
+
+
+class BestsellerRankingTestCase(TestCase):
+    """Testing time-decayed bestseller scores"""
+
+    def setUp(self):
+        self.old_hit, self.new_hit, self.unsold = (
+            Item.objects.create(
+                title=title,
+                price=100,
+                title_image=f"items/{title}.webp",
+                description="this is our new toy",
+            )
+            for title in ("old", "new", "unsold")
+        )
+        self.sell(self.old_hit, quantity=5, days_ago=120)
+        self.sell(self.new_hit, quantity=2, days_ago=1)
+        self.sell(self.unsold, quantity=9, days_ago=1, ordered=False)
+        return super().setUp()
+
+    def sell(self, item, quantity, days_ago, ordered=True):
+        """Create order for item placed days ago"""
+        order = Order.objects.create(
+            ordered=ordered,
+            ordered_date=timezone.now() - timedelta(days=days_ago),
+            session_key=f"{item.title}-{days_ago}",
+        )
+        OrderItem.objects.create(order=order, item=item, quantity=quantity)
+
+    def test_recent_sales_rank_higher(self):
+        """Recent sales outweigh older, bigger ones, carts are not counted"""
+        self.assertEqual(refresh_bestseller_scores(), 2)
+        ranked = Item.objects.filter(bestseller_score__gt=0).order_by(
+            "-bestseller_score"
+        )
+        self.assertEqual(list(ranked), [self.new_hit, self.old_hit])
+
+
+class HomeFragmentCacheTestCase(TestCase):
+    """Testing cached fragments of home page"""
+
+    def setUp(self):
+        cache.clear()
+        self.item = Item.objects.create(
+            title="Toy",
+            price=100,
+            title_image="items/toy.webp",
+            description="this is our new toy",
+        )
+        return super().setUp()
+
+    def get_home(self):
+        """Request home page, returns response and number of queries"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("core:home"))
+        return response, len(queries)
+
+    def test_fragments_cached_and_invalidated(self):
+        """Second request skips catalog queries, saving an item invalidates"""
+        _, cold_queries = self.get_home()
+        response, warm_queries = self.get_home()
+        self.assertLess(warm_queries, cold_queries)
+        self.assertContains(response, "Toy")
+
+        self.item.title = "Doll"
+        self.item.save()
+        response, _ = self.get_home()
+        self.assertContains(response, "Doll")
+        self.assertNotContains(response, "Toy")
+
+
+class ProductCacheTestCase(TestCase):
+    """Testing cached product page and conditional GET"""
+
+    def setUp(self):
+        cache.clear()
+        self.item = Item.objects.create(
+            title="Toy",
+            price=100,
+            title_image="items/toy.webp",
+            description="this is our new toy",
+        )
+        self.url = reverse("core:product", kwargs={"slug": self.item.slug})
+        return super().setUp()
+
+    def test_not_modified(self):
+        """Repeated request with ETag gets 304 until item changes"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.item.description = "this is our changed toy"
+        self.item.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "this is our changed toy")
+
+    def test_bulk_update(self):
+        """Cached product and its ETag follow bulk updates of any field"""
+        response = self.client.get(self.url)
+        self.assertContains(response, "100")
+        etag = response["ETag"]
+
+        Item.objects.filter(pk=self.item.pk).update(price=80, title="Doll")
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "80")
+        self.assertContains(response, "Doll")
+
+    def test_related_item_changed(self):
+        """Page is rendered again when a related item shown on it changes"""
+        related = Item.objects.create(
+            title="Doll",
+            price=100,
+            stock=5,
+            title_image="items/doll.webp",
+            description="this is our new doll",
+        )
+        RelatedItem.objects.create(item=self.item, related=related, score=1)
+        etag = self.client.get(self.url)["ETag"]
+
+        Item.objects.filter(pk=related.pk).update(price=80)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("Last-Modified", response)
+
+    def test_category_changed(self):
+        """Cached product follows rename and deletion of its category"""
+        category = CategoryItem.objects.create(name="Toys")
+        Item.objects.filter(pk=self.item.pk).update(category=category)
+        self.assertContains(self.client.get(self.url), "Toys")
+
+        category.name = "Games"
+        category.save()
+        self.assertContains(self.client.get(self.url), "Games")
+
+        category.delete()
+        self.assertNotContains(self.client.get(self.url), "Games")
+
+    def test_missing_product(self):
+        """Unknown slug is not found"""
+        response = self.client.get(reverse("core:product", kwargs={"slug": "none"}))
+        self.assertEqual(response.status_code, 404)
+
+
+class TypeaheadTestCase(TestCase):
+    """Testing search-as-you-type of item titles"""
+
+    def setUp(self):
+        cache.clear()
+        title_index.sequence = None  # Rebuilt from this test's database
+        self.item = Item.objects.create(
+            title="Alte Holzeisenbahn",
+            price=100,
+            title_image="items/train.webp",
+            description="this is our new toy",
+        )
+        return super().setUp()
+
+    def lookup(self, query):
+        """Titles found by typeahead endpoint"""
+        response = self.client.get(reverse("core:typeahead"), {"q": query})
+        return [result["title"] for result in response.json()["results"]]
+
+    def test_prefix_of_any_word(self):
+        """Prefixes of every word match, lookups do not query database"""
+        self.lookup("")  # Builds index
+        with self.assertNumQueries(0):
+            self.assertEqual(self.lookup("holz"), ["Alte Holzeisenbahn"])
+            self.assertEqual(self.lookup("Alte Ho"), ["Alte Holzeisenbahn"])
+            self.assertEqual(self.lookup("eisen"), [])
+
+    def test_follows_item_changes(self):
+        """Renamed and deleted items are updated in index"""
+        self.lookup("")
+        self.item.title = "Puppe"
+        self.item.save()
+        self.assertEqual(self.lookup("pup"), ["Puppe"])
+        self.assertEqual(self.lookup("holz"), [])
+        self.item.delete()
+        self.assertEqual(self.lookup("pup"), [])
+
+    def test_changes_of_other_processes(self):
+        """Other processes apply logged changes without rebuilding"""
+        other = TitleIndex()
+        other.lookup("")
+        self.item.title = "Puppe"
+        self.item.save()
+        other.checked_at = 0
+        with self.assertNumQueries(0):
+            self.assertEqual(other.lookup("pup"), [("Puppe", self.item.slug)])
+
+    def test_lost_changes(self):
+        """Process rebuilds in background once a change stays missing"""
+        other = TitleIndex()
+        other.lookup("")
+        self.item.title = "Puppe"
+        self.item.save()
+        cache.delete(CHANGE_KEY.format(sequence=other.sequence + 1))
+        with patch.object(other, "rebuild") as rebuild:
+            for _ in range(2):  # Missing change may still be written at first
+                other.checked_at = 0
+                other.lookup("holz")
+        rebuild.assert_called_once()
+
+    @patch("core.typeahead.MAX_TITLES", 1)
+    def test_newest_titles_kept(self):
+        """Index keeps MAX_TITLES newest items as items are added"""
+        self.lookup("")
+        Item.objects.create(
+            title="Puppe",
+            price=100,
+            title_image="items/doll.webp",
+            description="this is our new toy",
+        )
+        self.assertEqual(self.lookup("pup"), ["Puppe"])
+        self.assertEqual(self.lookup("holz"), [])
+
+
+class RecommendationsTestCase(TestCase):
+    """Testing "Customers also bought" recommendations"""
+
+    def setUp(self):
+        self.train, self.rails, self.doll = (
+            Item.objects.create(
+                title=title,
+                price=100,
+                title_image=f"items/{title}.webp",
+                description="this is our new toy",
+            )
+            for title in ("Train", "Rails", "Doll")
+        )
+        for basket in ([self.train, self.rails], [self.train, self.rails, self.doll]):
+            order = Order.objects.create(ordered=True)
+            for item in basket:
+                OrderItem.objects.create(order=order, item=item)
+        return super().setUp()
+
+    def test_related_items(self):
+        """Items bought together are shown, best match first, in all partitions"""
+        for partitions in (1, 2):
+            self.assertEqual(build_recommendations(partitions), 6)
+            response = self.client.get(self.train.get_absolute_url())
+            self.assertEqual(response.context["related_items"], [self.rails, self.doll])
+
+    def test_rows_replaced_at_end(self):
+        """Stored rows are kept while a rebuild counts, then replaced at once"""
+        build_recommendations()
+
+        def count(*args):
+            self.assertEqual(RelatedItem.objects.count(), 6)
+            return count_pairs(*args)
+
+        with patch("core.recommendations.count_pairs", side_effect=count):
+            self.assertEqual(build_recommendations(2), 6)
+        self.assertEqual(RelatedItem.objects.count(), 6)
+
+
+class ImageProcessingTestCase(TestCase):
+    """Testing background compression and renditions of uploaded images"""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings.enable()
+        self.item = Item.objects.create(
+            title="Toy",
+            price=100,
+            title_image=self.upload("toy.png"),
+            description="this is our new toy",
+        )
+        return super().setUp()
+
+    def upload(self, name, size=(1200, 800)):
+        """Uploaded png image"""
+        im_io = BytesIO()
+        Image.new("RGB", size, "red").save(im_io, format="png")
+        return SimpleUploadedFile(name, im_io.getvalue())
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.media_root)
+        return super().tearDown()
+
+    def test_compressed_in_background(self):
+        """Original is stored on save and swapped for webp by the worker"""
+        original = self.item.title_image.name
+        job = ImageJob.objects.get()
+        self.assertEqual(job.status, ImageJob.PENDING)
+        self.assertEqual(Item.objects.get().title_image_renditions, {})
+
+        self.assertEqual(process_image_jobs(), (1, 0))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (ImageJob.DONE, 1))
+        item = Item.objects.get()
+        self.assertNotEqual(item.title_image.name, original)
+        # Original is left to garbage collection after the grace period
+        call_command("collect_media_garbage", stdout=StringIO())
+        self.assertTrue(item.title_image.storage.exists(original))
+        call_command("collect_media_garbage", grace=0, stdout=StringIO())
+        self.assertFalse(item.title_image.storage.exists(original))
+        with item.title_image.open() as file:
+            self.assertEqual(Image.open(file).format, "WEBP")
+
+    def test_replaced_image_is_kept(self):
+        """Job of an image replaced before it ran does not swap"""
+        self.item.title_image = self.upload("train.png", size=(800, 600))
+        self.item.save()
+        replaced = self.item.title_image.name
+        self.assertEqual(process_image_jobs(limit=1), (1, 0))
+        self.assertEqual(Item.objects.get().title_image.name, replaced)
+
+    def test_retry(self):
+        """Broken image is retried later and fails after MAX_ATTEMPTS"""
+        self.item.title_image.storage.delete(self.item.title_image.name)
+        self.assertEqual(process_image_jobs(), (0, 1))
+        job = ImageJob.objects.get()
+        self.assertEqual(job.status, ImageJob.PENDING)
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertEqual(process_image_jobs(), (0, 0))
+
+        ImageJob.objects.update(
+            run_after=timezone.now(), attempts=ImageJob.MAX_ATTEMPTS - 1
+        )
+        self.assertEqual(process_image_jobs(), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImageJob.FAILED)
+
+    def test_renditions(self):
+        """Smaller widths and placeholder are stored and rendered inline"""
+        process_image_jobs()
+        renditions = Item.objects.get().title_image_renditions
+        self.assertEqual(sorted(renditions, key=int), ["320", "640", "1024", "1200"])
+        self.assertEqual(renditions["1200"], Item.objects.get().title_image.name)
+        with self.item.title_image.storage.open(renditions["320"]) as file:
+            self.assertEqual(Image.open(file).size, (320, 213))
+
+        card = Item.objects.cards().get()
+        html = Template(
+            "{% load image_tags %}"
+            "<img {% srcset card.title_image card.title_image_renditions "
+            "placeholder=card.title_image_placeholder %}>"
+        ).render(Context({"card": card}))
+        self.assertIn(f'src="/media/{renditions["320"]}"', html)
+        self.assertIn(f'/media/{renditions["1024"]} 1024w', html)
+        self.assertIn('width="1200" height="800"', html)
+        self.assertIn("url(data:image/webp;base64,", html)
+
+    def test_reencode(self):
+        """Re-encoding swaps in new files, a second run skips them by hash"""
+        process_image_jobs()
+        encoded = Item.objects.get().title_image.name
+        checkpoint = f"{self.media_root}/checkpoint.jsonl"
+        output = StringIO()
+        call_command("reencode_images", workers=1, checkpoint=checkpoint, stdout=output)
+        self.assertIn("Encoded 0, skipped 1, failed 0", output.getvalue())
+        self.assertEqual(Item.objects.get().title_image.name, encoded)
+
+        # Quality changed since the image was compressed
+        with patch("common.models.ENCODER", "eshop webp q90"):
+            call_command(
+                "reencode_images", workers=1, checkpoint=checkpoint, stdout=StringIO()
+            )
+        item = Item.objects.get()
+        self.assertNotEqual(item.title_image.name, encoded)
+        call_command("collect_media_garbage", grace=0, stdout=StringIO())
+        self.assertFalse(item.title_image.storage.exists(encoded))
+        self.assertEqual(item.title_image_renditions["1200"], item.title_image.name)
+
+        output = StringIO()
+        call_command("reencode_images", workers=1, checkpoint=checkpoint, stdout=output)
+        self.assertIn("Encoded 0, skipped 1, failed 0", output.getvalue())
+        self.assertEqual(Item.objects.get().title_image.name, item.title_image.name)
+
+    def test_reencode_renditions(self):
+        """Missing renditions of a compressed image are made without encoding it"""
+        process_image_jobs()
+        encoded = Item.objects.get().title_image.name
+        Item.objects.update(title_image_renditions={"1200": encoded})
+        output = StringIO()
+        call_command(
+            "reencode_images",
+            workers=1,
+            checkpoint=f"{self.media_root}/checkpoint.jsonl",
+            stdout=output,
+        )
+        self.assertIn("Encoded 1, skipped 0, failed 0", output.getvalue())
+        item = Item.objects.get()
+        self.assertEqual(item.title_image.name, encoded)
+        self.assertEqual(
+            sorted(item.title_image_renditions, key=int), ["320", "640", "1024", "1200"]
+        )
+
+    def test_checkpoint(self):
+        """Every image is recorded at once, a line cut off is ignored"""
+        path = f"{self.media_root}/checkpoint.jsonl"
+        with Checkpoint(path) as checkpoint:
+            checkpoint.add("core.item:1:title_image", "a")
+            checkpoint.add("core.item:2:title_image", "b")
+            with open(path, encoding="utf-8") as file:
+                self.assertEqual(len(file.readlines()), 3)
+            checkpoint.file.write('["core.item:3:ti')
+        self.assertEqual(len(Checkpoint(path).done), 2)
+        with Checkpoint(path):
+            pass
+        self.assertEqual(len(Checkpoint(path).done), 2)
+        self.assertEqual(Checkpoint(path, restart=True).done, {})
+
+    def test_reencode_placeholders(self):
+        """Placeholders of an earlier size are made again, the image is kept"""
+        process_image_jobs()
+        checkpoint = f"{self.media_root}/checkpoint.jsonl"
+        call_command(
+            "reencode_images", workers=1, checkpoint=checkpoint, stdout=StringIO()
+        )
+        encoded = Item.objects.get().title_image.name
+        Item.objects.update(title_image_placeholder={"width": 1200})
+
+        output = StringIO()
+        call_command("reencode_images", workers=1, checkpoint=checkpoint, stdout=output)
+        self.assertIn("Encoded 0, skipped 1, failed 0", output.getvalue())
+        self.assertIn("made 1 placeholders", output.getvalue())
+        item = Item.objects.get()
+        self.assertEqual(item.title_image.name, encoded)
+        self.assertEqual(item.title_image_placeholder["height"], 800)
+
+    def test_stored_again_not_collected(self):
+        """Saving content stored already restarts the grace period of its file"""
+        storage = self.item.title_image.storage
+        name = storage.save("loose.png", self.upload("loose.png", size=(10, 10)))
+        os.utime(storage.path(name), (0, 0))
+        self.assertEqual(
+            storage.save("again.png", self.upload("again.png", size=(10, 10))), name
+        )
+        call_command("collect_media_garbage", stdout=StringIO())
+        self.assertTrue(storage.exists(name))
+
+    def test_shared_files(self):
+        """Equal uploads share files, which are collected once unreferenced"""
+        other = Item.objects.create(
+            title="Other toy",
+            price=100,
+            title_image=self.upload("other.png"),
+            description="this is our new toy",
+        )
+        self.assertEqual(other.title_image.name, self.item.title_image.name)
+        self.assertEqual(process_image_jobs(), (2, 0))
+        self.item.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(other.title_image.name, self.item.title_image.name)
+        self.assertEqual(other.title_image_renditions, self.item.title_image_renditions)
+
+        response = self.client.get(self.item.title_image.url)
+        self.assertIn("immutable", response["Cache-Control"])
+
+        files = set(self.item.title_image_renditions.values())
+        self.item.delete()
+        call_command("collect_media_garbage", grace=0, stdout=StringIO())
+        self.assertTrue(all(map(other.title_image.storage.exists, files)))
+        other.delete()
+        call_command("collect_media_garbage", grace=0, stdout=StringIO())
+        self.assertFalse(any(map(other.title_image.storage.exists, files)))
@@ -0,0 +1,195 @@
+"""
+Process local prefix index of item titles for search-as-you-type.
+
+Every word start of a normalized title is kept in a sorted array, so a
+prefix lookup is a binary search plus a short scan and never queries the
+database. The index is built on first use. Item changes are applied in the
+process that saved the item and appended to a change log in the shared
+cache, numbered by a sequence key. Other processes apply new changes on
+their next lookup. Only a process that missed changes, because they expired
+or were evicted from the log, rebuilds, in a background thread while lookups
+keep using its old index.
+"""
+
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.core.cache import cache
+from django.db import connection
+
+from .search import get_tokens
+
+SEQUENCE_KEY = "core:typeahead_sequence"
+CHANGE_KEY = "core:typeahead_change:{sequence}"
+# Seconds changes are kept for other processes, those further behind rebuild
+CHANGE_TIMEOUT = 60 * 60
+# Most changes applied at once, processes further behind rebuild
+MAX_CHANGES = 1000
+# Newest items kept in index, bounds memory use of every process
+MAX_TITLES = 50000
+MAX_WORDS_PER_TITLE = 8
+# Seconds between checks of the change log
+CHANGE_CHECK_INTERVAL = 5
+
+
+def get_keys(title):
+    """Normalized suffixes of title starting at each word"""
+    words = get_tokens(title)[:MAX_WORDS_PER_TITLE]
+    return {" ".join(words[index:]) for index in range(len(words))}
+
+
+def get_sequence():
+    """Number of the last change in the change log"""
+    cache.add(SEQUENCE_KEY, 0, None)
+    return cache.get(SEQUENCE_KEY, 0)
+
+
+class TitleIndex:
+    """Sorted array of (key, item id) with titles and slugs of items"""
+
+    def __init__(self):
+        self.keys = []
+        self.items = {}
+        # Last change of the log applied, None until built
+        self.sequence = None
+        self.checked_at = 0
+        # Change found missing on the last check, it may still be written
+        self.missing = None
+        self.rebuilding = False
+        self.lock = threading.Lock()
+
+    def build(self):
+        """Load newest titles from database"""
+        from .models import Item  # pylint: disable=import-outside-toplevel
+
+        # Changes made while loading are applied again afterwards
+        sequence = get_sequence()
+        rows = Item.objects.order_by("-created_date").values_list(
+            "id", "title", "slug"
+        )[:MAX_TITLES]
+        items = {pk: (title, slug) for pk, title, slug in rows}
+        keys = sorted(
+            (key, pk) for pk, (title, _) in items.items() for key in get_keys(title)
+        )
+        with self.lock:
+            self.keys, self.items, self.sequence = keys, items, sequence
+            self.missing = None
+
+    def rebuild(self):
+        """Build in a background thread, lookups use the old index meanwhile"""
+
+        def run():
+            try:
+                self.build()
+            finally:
+                self.rebuilding = False
+                connection.close()
+
+        with self.lock:
+            if self.rebuilding:
+                return
+            self.rebuilding = True
+        threading.Thread(target=run, daemon=True).start()
+
+    def ensure_fresh(self):
+        """Build on first use, apply changes of other processes"""
+        if self.sequence is None:
+            self.build()
+            return
+        now = time.monotonic()
+        if now - self.checked_at < CHANGE_CHECK_INTERVAL:
+            return
+        self.checked_at = now
+        if not self.apply_changes():
+            self.rebuild()
+
+    def apply_changes(self):
+        """Apply new changes of the log in order, False if some are lost"""
+        sequence = get_sequence()
+        first = self.sequence + 1
+        if sequence < self.sequence or sequence - self.sequence > MAX_CHANGES:
+            return False  # Log started over or index too far behind
+        keys = [
+            CHANGE_KEY.format(sequence=number) for number in range(first, sequence + 1)
+        ]
+        changes = cache.get_many(keys)
+        with self.lock:
+            for number, key in enumerate(keys, first):
+                if key not in changes:
+                    if self.missing == number:
+                        return False  # Still missing, so expired or evicted
+                    self.missing = number  # May be written right now
+                    break
+                pk, title, slug = changes[key]
+                if title is None:
+                    self._remove(pk)
+                else:
+                    self._add(pk, title, slug)
+                self.sequence = number
+        return True
+
+    def lookup(self, prefix, limit=8):
+        """Up to limit (title, slug) of items with a word starting with prefix"""
+        self.ensure_fresh()
+        prefix = " ".join(get_tokens(prefix))
+        if not prefix:
+            return []
+        found = {}
+        # Changes insert into and delete from the arrays in place
+        with self.lock:
+            keys, items = self.keys, self.items
+            index = bisect_left(keys, (prefix,))
+            while index < len(keys) and len(found) < limit:
+                key, pk = keys[index]
+                if not key.startswith(prefix):
+                    break
+                if pk in items:
+                    found.setdefault(pk, items[pk])
+                index += 1
+        return list(found.values())
+
+    def _remove(self, pk):
+        title, _ = self.items.pop(pk, (None, None))
+        if title is not None:
+            for key in get_keys(title):
+                index = bisect_left(self.keys, (key, pk))
+                if index < len(self.keys) and self.keys[index] == (key, pk):
+                    del self.keys[index]
+
+    def _add(self, pk, title, slug):
+        self._remove(pk)
+        if len(self.items) >= MAX_TITLES:
+            # Ids grow with creation, the index keeps the newest items
+            oldest = min(self.items)
+            if pk < oldest:
+                return
+            self._remove(oldest)
+        self.items[pk] = (title, slug)
+        for key in get_keys(title):
+            insort(self.keys, (key, pk))
+
+    def update(self, pk, title, slug):
+        """Add item or replace its title"""
+        with self.lock:
+            if self.sequence is not None:
+                self._add(pk, title, slug)
+        self.publish(pk, title, slug)
+
+    def remove(self, pk):
+        """Remove item"""
+        with self.lock:
+            if self.sequence is not None:
+                self._remove(pk)
+        self.publish(pk, None, None)
+
+    def publish(self, pk, title, slug):
+        """Append change to the log for other processes, None title removes"""
+        get_sequence()
+        sequence = cache.incr(SEQUENCE_KEY)
+        cache.set(
+            CHANGE_KEY.format(sequence=sequence), (pk, title, slug), CHANGE_TIMEOUT
+        )
+
+
+title_index = TitleIndex()
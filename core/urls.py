@@ -1,7 +1,7 @@
 from django.urls import path
 from django.views.generic import TemplateView
 
-from .views import HomeView, ItemDetailView
+from .views import HomeView, ItemDetailView, typeahead
 
 app_name = "core"
 
@@ -9,6 +9,7 @@ app_name = "core"
 urlpatterns = [
     path("", HomeView.as_view(), name="home"),
     path("product/<slug>/", ItemDetailView.as_view(), name="product"),
+    path("typeahead/", typeahead, name="typeahead"),
     path(
         "data-protection/",
         TemplateView.as_view(template_name="data_protection.html"),
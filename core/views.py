@@ -1,46 +1,195 @@
-from django.shortcuts import render
+from functools import partial
+from hashlib import md5
+
+from django.contrib import messages
+from django.core.cache import cache
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404, render
+from django.urls import reverse
+from django.utils.decorators import method_decorator
+from django.utils.functional import SimpleLazyObject
+from django.utils.translation import get_language
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 from django.views.generic import DetailView, View
 
-from .models import Carousel, Item
+from .cache import (
+    PRODUCT_TIMEOUT,
+    get_catalog_version,
+    get_product_key,
+    get_recommendations_version,
+)
+from .models import SORT_ORDERINGS, Carousel, CategoryItem, Item, RelatedItem
+from .pagination import KeysetPage, KeysetPaginator
+from .search import SEARCH_LIMIT, search_items
+from .templatetags.order_template_tags import order_item_count
+from .typeahead import title_index
 
 
 class HomeView(View):
-    def get(self, *args, **kwargs):
-        paginate_by = 8
-        recently_added_items = (
-            Item.objects.select_related("category").all().order_by("created_date")
+    paginate_by = 8
+
+    def get_page_url(self, **cursor):
+        """Query string of current filters with new pagination cursor"""
+        query = self.request.GET.copy()
+        for name in ("after", "before", "offset"):
+            query.pop(name, None)
+        query.update(cursor)
+        return f"?{query.urlencode()}#basicExampleNav"
+
+    def get_page(self, items):
+        """Current page of items. Search results are ranked by relevance instead"""
+        search = self.request.GET.get("search")
+        if search:
+            return self.get_search_page(items, search)
+        ordering = SORT_ORDERINGS.get(self.request.GET.get("sort"), "-created_date")
+        page = KeysetPaginator(items, self.paginate_by, ordering).get_page(
+            after=self.request.GET.get("after"),
+            before=self.request.GET.get("before"),
+        )
+        page.next_page_url = (
+            self.get_page_url(after=page.next_cursor) if page.next_cursor else None
+        )
+        page.previous_page_url = (
+            self.get_page_url(before=page.previous_cursor)
+            if page.previous_cursor
+            else None
         )
-        categories = {item.category for item in recently_added_items}
+        return page
+
+    def get_search_page(self, items, search):
+        """
+        Page of SEARCH_LIMIT search results. Ranks give no cursor to seek from,
+        so search pages by offset
+        """
+        try:
+            offset = max(0, int(self.request.GET.get("offset", 0)))
+        except ValueError:
+            offset = 0
+        rows = search_items(items, search, SEARCH_LIMIT + 1, offset)
+        page = KeysetPage(
+            rows[:SEARCH_LIMIT],
+            has_next=len(rows) > SEARCH_LIMIT,
+            has_previous=offset > 0,
+        )
+        page.next_page_url = (
+            self.get_page_url(offset=str(offset + SEARCH_LIMIT))
+            if page.has_next
+            else None
+        )
+        page.previous_page_url = (
+            self.get_page_url(offset=str(max(0, offset - SEARCH_LIMIT)))
+            if offset
+            else None
+        )
+        return page
+
+    def get_bestsellers(self, items):
+        """Bestsellers among filtered items or among top search results"""
+        search = self.request.GET.get("search")
+        if search:
+            # Cached for every page of the search, so not the current page
+            return sorted(
+                (
+                    item
+                    for item in search_items(items, search)
+                    if item.bestseller_score > 0
+                ),
+                key=lambda item: item.bestseller_score,
+                reverse=True,
+            )[:8]
+        return items.filter(bestseller_score__gt=0).order_by("-bestseller_score")[:8]
+
+    def get(self, *args, **kwargs):
+        recently_added_items = Item.objects.cards()
+        categories = CategoryItem.objects.filter(item_count__gt=0).order_by("name")
         if self.request.GET.get("category"):
             category_filter = self.request.GET.get("category")
             recently_added_items = recently_added_items.filter(category=category_filter)
+        recently_added_items = recently_added_items.price_between(
+            self.request.GET.get("min_price"), self.request.GET.get("max_price")
+        )
 
-        if self.request.GET.get("search"):
-            search = self.request.GET.get("search")
-            recently_added_items = recently_added_items.filter(title__icontains=search)
-
-        bestseller_items = recently_added_items.filter(ordered_counter__gt=0).order_by(
-            "-ordered_counter"
-        )[:8]
+        # Evaluated only when rendered, i.e. not when the fragment is cached
+        page = SimpleLazyObject(partial(self.get_page, recently_added_items))
+        bestseller_items = SimpleLazyObject(
+            partial(self.get_bestsellers, recently_added_items)
+        )
         carousel_slides = Carousel.objects.order_by("index").all()
         context = {
             "carousel_slides": carousel_slides,
-            "recently_added_items": recently_added_items,
+            "recently_added_items": page,
             "bestseller_items": bestseller_items,
-            "paginate_by": paginate_by,
+            "paginate_by": self.paginate_by,
             "categories": categories,
+            "catalog_version": get_catalog_version(),
         }
 
         return render(self.request, "home.html", context)
 
 
+def get_product(request, slug):
+    """
+    Item with category and images, read through cache.
+    Kept on request, as conditional GET and view both need it
+    """
+    if getattr(request, "product", None) is None or request.product.slug != slug:
+        key = get_product_key(slug)
+        request.product = cache.get(key)
+        if request.product is None:
+            request.product = get_object_or_404(
+                Item.objects.select_related("category").prefetch_related("images"),
+                slug=slug,
+            )
+            cache.set(key, request.product, PRODUCT_TIMEOUT)
+    return request.product
+
+
+def product_etag(request, slug):
+    """
+    ETag of product page: item and related items version and everything personal
+    on the page. Related items show title, price and stock, the catalog version
+    changes with them. Pages with pending messages are always rendered
+    """
+    if len(messages.get_messages(request)):
+        return None
+    item = get_product(request, slug)
+    version = (
+        f"{item.pk}:{item.updated_date.isoformat()}:{get_language()}:"
+        f"{request.user.pk}:{order_item_count(request)}:"
+        f"{get_recommendations_version()}:{get_catalog_version()}"
+    )
+    return md5(version.encode()).hexdigest()
+
+
+# No Last-Modified, date of product misses changes of related items
+@method_decorator(cache_control(private=True, no_cache=True), name="dispatch")
+@method_decorator(condition(etag_func=product_etag), name="get")
 class ItemDetailView(DetailView):
     model = Item
     template_name = "product.html"
 
     def get_object(self, queryset=None):
-        return (
-            self.model.objects.select_related("category")
-            .prefetch_related("images")
-            .get(slug=self.kwargs["slug"])
-        )
+        return get_product(self.request, self.kwargs["slug"])
+
+    def get_context_data(self, **kwargs):
+        """Add items bought together with this item"""
+        context = super().get_context_data(**kwargs)
+        context["related_items"] = [
+            related.related
+            for related in RelatedItem.objects.filter(
+                item=self.object, related__stock__gt=0
+            )
+            .select_related("related")
+            .order_by("-score")[:4]
+        ]
+        return context
+
+
+def typeahead(request):
+    """Item titles starting with ?q=, answered from memory without database"""
+    results = [
+        {"title": title, "url": reverse("core:product", kwargs={"slug": slug})}
+        for title, slug in title_index.lookup(request.GET.get("q", ""))
+    ]
+    return JsonResponse({"results": results})
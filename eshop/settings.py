@@ -200,15 +200,31 @@ STATICFILES_STORAGE = "whitenoise.storage.CompressedStaticFilesStorage"
 
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 MEDIA_URL = "/media/"
+# Media stored by content hash, served with immutable Cache-Control
+DEFAULT_FILE_STORAGE = "common.storage.ContentAddressedStorage"
 
 DATA_UPLOAD_MAX_MEMORY_SIZE = 41943040  # File upload size to 40Mb
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10485760
+# Uploaded images are downscaled to fit, bigger ones are refused (see common.models.compress)
+IMAGE_MAX_DIMENSION = 2560
+IMAGE_MAX_PIXELS = 60000000
+# On-the-fly resized images (common.resize), least recently used are evicted
+RESIZE_CACHE_DIR = os.path.join(BASE_DIR, "resize_cache")
+RESIZE_CACHE_MAX_SIZE = 512 * 1024 * 1024
+# Seconds stock stays held for an order after checkout (see order.models.Reservation)
+STOCK_RESERVATION_TTL = 15 * 60
 
 # Extra lookup directories for collectstatic to find static files
 prod_db = dj_database_url.config(conn_max_age=500)
 DATABASES["default"].update(prod_db)
 # HEROKU END
 
+if DATABASES["default"]["ENGINE"] == "django.db.backends.sqlite3":
+    # Tests run on a file, threads of concurrency tests cannot share an
+    # in-memory database, and they wait for locks instead of failing
+    DATABASES["default"]["TEST"] = {"NAME": BASE_DIR / "test_db.sqlite3"}
+    DATABASES["default"]["OPTIONS"] = {"timeout": 30}
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
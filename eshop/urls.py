@@ -3,11 +3,15 @@ from django.conf.urls.static import static
 from django.conf.urls.i18n import i18n_patterns
 from django.contrib import admin
 from django.contrib.staticfiles.urls import staticfiles_urlpatterns
-from django.urls import path, include
+from django.urls import path, include, re_path
+
+from common.storage import PREFIX
+from common.views import resize_image, serve_immutable_media
 
 urlpatterns = [
     path("api/v1/", include("rest_framework.urls", namespace="rest_framework")),
     path("api/v1/", include("core.api_core.urls")),
+    path("api/v1/", include("order.api_order.urls")),
     path("i18n/", include("django.conf.urls.i18n")),  # For set_language in Navbar
 ]
 
@@ -16,6 +20,17 @@ if settings.DEBUG:
 
     urlpatterns += [path("__debug__", include(debug_toolbar.urls))]
 
+urlpatterns += [
+    re_path(
+        rf"^{settings.MEDIA_URL.lstrip('/')}resize/(?P<width>\d+)x(?P<height>\d+)/(?P<path>.+)$",
+        resize_image,
+        name="resize-image",
+    ),
+    re_path(
+        rf"^{settings.MEDIA_URL.lstrip('/')}(?P<path>{PREFIX}/.*)$",
+        serve_immutable_media,
+    ),
+]
 urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 urlpatterns += staticfiles_urlpatterns()
 urlpatterns += i18n_patterns(
@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.utils.translation import gettext as _
 from payment.models import Payment
 
-from .models import Order, OrderItem, TrackingCompany
+from .models import Order, OrderItem, Reservation, TrackingCompany
 from refund.admin import RefundAdminInline
 
 
@@ -21,6 +21,13 @@ class OrderItemAdminInline(admin.TabularInline):
     can_delete = False
 
 
+class ReservationAdminInline(admin.TabularInline):
+    model = Reservation
+    max_num = 0
+    readonly_fields = ["item", "quantity", "expires_at"]
+    can_delete = False
+
+
 class PaymentAdminInline(admin.TabularInline):
     model = Payment
     max_num = 0
@@ -39,6 +46,9 @@ class OrderAdmin(admin.ModelAdmin):
         "ordered_date",
         "ref_code",
         "address",
+        "get_subtotal",
+        "get_delivery_total",
+        "get_total",
     ]
     list_display = [
         "ordered",
@@ -46,6 +56,7 @@ class OrderAdmin(admin.ModelAdmin):
         "user",
         "get_email",
         "address",
+        "get_total",
         "being_delivered",
         "refund_requested",
         "refund_granted",
@@ -67,10 +78,26 @@ class OrderAdmin(admin.ModelAdmin):
     actions = [make_refund_accepted]
     inlines = [
         OrderItemAdminInline,
+        ReservationAdminInline,
         PaymentAdminInline,
         RefundAdminInline,
     ]
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_totals()
+
+    @admin.display(description=_("Subtotal"), ordering="subtotal")
+    def get_subtotal(self, obj):
+        return obj.subtotal
+
+    @admin.display(description=_("Delivery"), ordering="delivery_total")
+    def get_delivery_total(self, obj):
+        return obj.delivery_total
+
+    @admin.display(description=_("Total"), ordering="total")
+    def get_total(self, obj):
+        return obj.total
+
     @admin.display(description="Email")
     def get_email(self, obj):
         if obj.address:
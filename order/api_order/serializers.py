@@ -1,6 +1,9 @@
 from rest_framework import serializers
 from order.models import Order, OrderItem
 
+# Most changes applied in one request
+CART_MAX_CHANGES = 100
+
 
 class OrderSerializer(serializers.HyperlinkedModelSerializer):
     """Order serializer"""
@@ -16,3 +19,44 @@ class OrderItemSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = OrderItem
         fields = "__all__"
+
+
+class CartChangeSerializer(serializers.Serializer):  # pylint: disable=abstract-method
+    """Change of quantity of one item in cart"""
+
+    slug = serializers.SlugField()
+    action = serializers.ChoiceField(choices=["add", "set", "remove"], default="add")
+    quantity = serializers.IntegerField(min_value=0, default=1)
+
+
+class CartUpdateSerializer(serializers.Serializer):  # pylint: disable=abstract-method
+    """Changes applied to cart together"""
+
+    changes = serializers.ListField(
+        child=CartChangeSerializer(), allow_empty=False, max_length=CART_MAX_CHANGES
+    )
+
+
+class CartLineSerializer(serializers.Serializer):  # pylint: disable=abstract-method
+    """Order item in cart"""
+
+    slug = serializers.CharField(source="item.slug")
+    title = serializers.CharField(source="item.title")
+    quantity = serializers.IntegerField()
+    price = serializers.DecimalField(
+        source="item.final_price", max_digits=10, decimal_places=2
+    )
+    total = serializers.DecimalField(
+        source="get_total_item_price", max_digits=12, decimal_places=2
+    )
+
+
+class CartSerializer(serializers.Serializer):  # pylint: disable=abstract-method
+    """Cart lines and totals"""
+
+    lines = CartLineSerializer(many=True)
+    line_count = serializers.IntegerField()
+    subtotal = serializers.DecimalField(max_digits=12, decimal_places=2)
+    delivery_total = serializers.DecimalField(max_digits=12, decimal_places=2)
+    savings = serializers.DecimalField(max_digits=12, decimal_places=2)
+    total = serializers.DecimalField(max_digits=12, decimal_places=2)
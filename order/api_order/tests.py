@@ -1,3 +1,99 @@
-from django.test import TestCase
+"""API order testing"""
 
-# Create your tests here.
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from core.models import Item
+from order.models import Order, OrderItem, Reservation
+
+
+class CartAPITestCase(APITestCase):
+    """Testing batch cart updates"""
+
+    def setUp(self):
+        self.toy, self.book, self.doll = (
+            Item.objects.create(
+                title=title,
+                price=100,
+                delivery_price=5,
+                stock=3,
+                title_image=f"items/{title}.webp",
+                description="this is our new toy",
+            )
+            for title in ("toy", "book", "doll")
+        )
+        self.user = User.objects.create_user("buyer")
+        return super().setUp()
+
+    def post(self, *changes):
+        """Post changes to cart"""
+        return self.client.post(
+            reverse("cart"), {"changes": list(changes)}, format="json"
+        )
+
+    def test_batch_update(self):
+        """Changes of several items are applied at once, totals are returned"""
+        self.client.force_authenticate(self.user)
+        self.post({"slug": self.toy.slug}, {"slug": self.doll.slug})
+        response = self.post(
+            {"slug": self.toy.slug, "action": "add", "quantity": 2},
+            {"slug": self.book.slug, "action": "set", "quantity": 2},
+            {"slug": self.doll.slug, "action": "remove"},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            {line["slug"]: line["quantity"] for line in response.data["lines"]},
+            {self.toy.slug: 3, self.book.slug: 2},
+        )
+        self.assertEqual(Decimal(response.data["subtotal"]), Decimal("500.00"))
+        self.assertEqual(Decimal(response.data["delivery_total"]), Decimal("6.00"))
+        self.assertEqual(Decimal(response.data["total"]), Decimal("506.00"))
+        self.assertEqual(OrderItem.objects.filter(order__user=self.user).count(), 2)
+
+    def test_all_or_nothing(self):
+        """If one change fails, no change is applied"""
+        self.client.force_authenticate(self.user)
+        response = self.post(
+            {"slug": self.toy.slug},
+            {"slug": self.book.slug, "action": "set", "quantity": 4},
+            {"slug": "missing"},
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(set(response.data["errors"]), {self.book.slug, "missing"})
+        self.assertFalse(Order.objects.exists())
+
+    def test_held_stock(self):
+        """Stock held for another order at checkout is not available"""
+        other = Order.objects.create(session_key="other")
+        OrderItem.objects.create(order=other, item=self.toy, quantity=2)
+        Reservation.objects.reserve(other)
+        self.client.force_authenticate(self.user)
+        response = self.post({"slug": self.toy.slug, "action": "set", "quantity": 2})
+        self.assertEqual(set(response.data["errors"]), {self.toy.slug})
+        self.assertEqual(self.post({"slug": self.toy.slug}).status_code, 200)
+
+    def test_lower_when_held_elsewhere(self):
+        """Items can be reduced and removed while other holds exceed stock"""
+        self.client.force_authenticate(self.user)
+        self.post({"slug": self.toy.slug, "action": "set", "quantity": 3})
+        other = Order.objects.create(session_key="other")
+        OrderItem.objects.create(order=other, item=self.toy, quantity=self.toy.stock)
+        Reservation.objects.reserve(other)
+
+        response = self.post({"slug": self.toy.slug, "action": "set", "quantity": 1})
+        self.assertEqual(response.status_code, 200)
+        response = self.post({"slug": self.toy.slug, "action": "remove"})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(OrderItem.objects.filter(order__user=self.user).exists())
+
+    def test_anonymous_session_cart(self):
+        """Anonymous cart is kept in session and writes no orders"""
+        self.post({"slug": self.toy.slug, "quantity": 2}, {"slug": self.book.slug})
+        response = self.client.get(reverse("cart"))
+        self.assertEqual(response.data["line_count"], 2)
+        self.assertEqual(Decimal(response.data["total"]), Decimal("306.00"))
+        self.assertFalse(Order.objects.exists())
@@ -0,0 +1,7 @@
+from django.urls import path
+
+from order.api_order import views
+
+urlpatterns = [
+    path("cart/", views.cart, name="cart"),
+]
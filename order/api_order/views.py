@@ -1,54 +1,46 @@
-from math import perm
-from django.shortcuts import get_object_or_404
+"""JSON cart API"""
+
+from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from rest_framework import authentication, permissions
-from core.api_core.serializers import ItemSerializer
 
-from core.models import Item
-from order.api_order.serializers import OrderSerializer
-from order.models import Order, OrderItem
+from order.api_order.serializers import CartSerializer, CartUpdateSerializer
+from order.cart import SessionCart, get_open_cart, update_cart
+from order.models import TOTAL_FIELDS, Order
+
 
+def get_cart_data(request):
+    """Lines and totals of cart, in one query for totals and two for lines"""
+    if not request.user.is_authenticated:
+        order, order_items = SessionCart(request).get_order()
+    else:
+        order = (
+            get_open_cart(request)
+            .with_totals()
+            .prefetch_related("orderitem_set__item")
+            .first()
+        )
+        if order is None:
+            order, order_items = Order(), []
+            order.set_totals(order_items)
+        else:
+            order_items = order.orderitem_set.all()
+    totals = {name: getattr(order, name) for name in TOTAL_FIELDS}
+    return CartSerializer({"lines": order_items, **totals}).data
 
-@api_view(["GET"])
-def add_to_cart(request, slug):
+
+@api_view(["GET", "POST"])
+def cart(request):
     """
-    Add item to order. If order does not exist, create new one.
-    If user is authenticated, order.user will be filled.
-    If user is anon, order.session_key will be used
+    GET cart lines and totals. POST {"changes": [{"slug", "action", "quantity"}]}
+    with action "add" (default), "set" or "remove" applies all changes in one
+    transaction and returns the recomputed cart. If any change fails, none
+    is applied and errors by slug are returned
     """
-    item = get_object_or_404(Item, slug=slug)
-    if item.stock <= 0:
-        return Response({"error": "Item out of stock"})
-    if not request.user.is_authenticated and not request.session.exists(
-        request.session.session_key
-    ):
-        request.session.create()
-    order = Order.objects.filter(
-        ordered=False,
-        user=(request.user if request.user.is_authenticated else None),
-        session_key=(
-            None if request.user.is_authenticated else request.session.session_key
-        ),
-    ).first()
-    if order is not None:
-        order_serializer = OrderSerializer(order)
-        order_item, created = OrderItem.objects.get_or_create(item=item, order=order)
-        if not created:
-            order_item.quantity += 1
-            if order_item.quantity > item.stock:
-                return Response({"error": "Order quantity exceeds item stock"})
-            order_item.save()
-            return Response(order_serializer.data)
-        return Response(order_serializer.data)
-
-    order = Order.objects.create(
-        user=request.user if request.user.is_authenticated else None,
-        start_date=timezone.now(),
-        session_key=(
-            None if request.user.is_authenticated else request.session.session_key
-        ),
-    )
-    order_item = OrderItem.objects.create(item=item, order=order)
-    messages.info(request, _("Quantity was updated"))
-    return redirect("order:cart-summary")
+    if request.method == "POST":
+        serializer = CartUpdateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        errors = update_cart(request, serializer.validated_data["changes"])
+        if errors:
+            return Response({"errors": errors}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(get_cart_data(request))
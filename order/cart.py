@@ -1,86 +1,432 @@
 from django.shortcuts import get_object_or_404, redirect
-from django.utils import timezone
 from django.contrib import messages
-from django.db.models import Prefetch
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, OuterRef, Subquery
 from django.utils.translation import gettext_lazy as _
 
 from core.models import Item
-from .models import Order, OrderItem
+from .models import Order, OrderItem, Reservation
+
+CART_COUNT_KEY = "order:cart_count:{user}"
+CART_COUNT_TIMEOUT = 60 * 60 * 24
+SESSION_CART_KEY = "cart"
+
+
+def get_cart_owner(request):
+    """Lookups of open cart of user or anonymous session"""
+    return {
+        "ordered": False,
+        "user": request.user if request.user.is_authenticated else None,
+        "session_key": (
+            None if request.user.is_authenticated else request.session.session_key
+        ),
+    }
+
+
+def get_open_cart(request):
+    """
+    Open cart of user or anonymous session as queryset, for views reading it
+    with totals and lines. Its id is found index only in the open cart owner
+    indexes and the row is then read by pk, so joins to the lines do not lead
+    the planner to the unique constraint and a sort
+    """
+    return Order.objects.filter(
+        pk__in=Subquery(
+            Order.objects.filter(**get_cart_owner(request)).values("id")[:1]
+        )
+    )
+
+
+def get_cart_id(request):
+    """
+    Id of open cart of user or anonymous session, None if there is none.
+    Updates filter lines by it, joins to the order would move their
+    conditions into a subquery that is not checked again after a lock wait
+    """
+    return (
+        Order.objects.filter(**get_cart_owner(request))
+        .values_list("id", flat=True)
+        .first()
+    )
+
+
+def get_cart_items(request):
+    """Order items in open cart of user or anonymous session"""
+    owner = get_cart_owner(request)
+    return OrderItem.objects.filter(
+        **{f"order__{name}": value for name, value in owner.items()}
+    )
+
+
+def get_cart_count_key(request):
+    """Cache key of cart line count of user, None for anonymous visitors"""
+    if request.user.is_authenticated:
+        return CART_COUNT_KEY.format(user=request.user.pk)
+    return None
+
+
+def get_cart_count(request):
+    """Number of lines in cart, counted only if not cached"""
+    if not request.user.is_authenticated:
+        return len(SessionCart(request))
+    count = cache.get(get_cart_count_key(request))
+    if count is None:
+        count = refresh_cart_count(request)
+    return count
+
+
+def refresh_cart_count(request):
+    """Count lines of cart again and cache the count"""
+    count = get_cart_items(request).count()
+    set_cart_count(request, count)
+    return count
+
+
+def set_cart_count(request, count):
+    """Cache known number of lines in cart"""
+    key = get_cart_count_key(request)
+    if key is not None:
+        cache.set(key, count, CART_COUNT_TIMEOUT)
+
+
+class SessionCart:
+    """
+    Cart of anonymous visitor kept in session as {item id: quantity}.
+    Written to database only at checkout, see save_order()
+    """
+
+    def __init__(self, request):
+        self.session = request.session
+        self.lines = self.session.get(SESSION_CART_KEY, {})
+
+    def __len__(self):
+        return len(self.lines)
+
+    def save(self):
+        """Store lines in session, dropping the cart once empty"""
+        if self.lines:
+            self.session[SESSION_CART_KEY] = self.lines
+        else:
+            self.session.pop(SESSION_CART_KEY, None)
+
+    def add(self, item):
+        """Raise quantity of item by one while below stock"""
+        quantity = self.lines.get(str(item.pk), 0)
+        if quantity >= item.stock:
+            return False
+        self.lines[str(item.pk)] = quantity + 1
+        self.save()
+        return True
+
+    def remove(self, item):
+        """Remove item from cart"""
+        if self.lines.pop(str(item.pk), None) is None:
+            return False
+        self.save()
+        return True
+
+    def decrement(self, item):
+        """Lower quantity of item by one, remove it if only one is left"""
+        quantity = self.lines.get(str(item.pk))
+        if quantity is None:
+            return False
+        if quantity > 1:
+            self.lines[str(item.pk)] = quantity - 1
+        else:
+            del self.lines[str(item.pk)]
+        self.save()
+        return True
+
+    def clear(self):
+        """Empty cart"""
+        self.lines = {}
+        self.save()
+
+    def get_order_items(self):
+        """Unsaved order items of cart, items gone from catalog are skipped"""
+        items = Item.objects.in_bulk([int(pk) for pk in self.lines])
+        return [
+            OrderItem(item=items[int(pk)], quantity=quantity)
+            for pk, quantity in self.lines.items()
+            if int(pk) in items
+        ]
+
+    def get_order(self):
+        """Unsaved order with totals and its order items"""
+        order_items = self.get_order_items()
+        order = Order(session_key=self.session.session_key)
+        order.set_totals(order_items)
+        return order, order_items
+
+    def save_order(self):
+        """
+        Write cart to open order of session, replacing its previous lines.
+        None if cart is empty
+        """
+        order_items = self.get_order_items()
+        if not order_items:
+            return None
+        with transaction.atomic():
+            order = Order.objects.get_or_create(
+                ordered=False, user=None, session_key=self.session.session_key
+            )[0]
+            order.orderitem_set.all().delete()
+            for order_item in order_items:
+                order_item.order = order
+            OrderItem.objects.bulk_create(order_items)
+        return order
+
+
+def merge_session_cart(request, user):
+    """Move session cart into open order of user, quantities limited by stock"""
+    cart = SessionCart(request)
+    if not cart:
+        return
+    with transaction.atomic():
+        order = Order.objects.get_or_create(ordered=False, user=user, session_key=None)[
+            0
+        ]
+        existing = {
+            line.item_id: line for line in order.orderitem_set.select_related("item")
+        }
+        created, updated = [], []
+        for line in cart.get_order_items():
+            if line.item_id in existing:
+                line, quantity = existing[line.item_id], line.quantity
+                line.quantity = min(line.quantity + quantity, line.item.stock)
+                updated.append(line)
+            elif line.item.stock > 0:
+                line.order = order
+                line.quantity = min(line.quantity, line.item.stock)
+                created.append(line)
+        OrderItem.objects.bulk_create(created)
+        OrderItem.objects.bulk_update(updated, ["quantity"])
+    cart.clear()
+    # Counted again on next read, request.user may not be set yet at login
+    cache.delete(CART_COUNT_KEY.format(user=user.pk))
+
+
+def apply_changes(quantities, items, changes, available):
+    """
+    {item id: quantity} after changes of "add", "set" or "remove" by slug,
+    and errors by slug. Raised quantities may not exceed available stock,
+    lowering is always allowed, even if other holds took the stock meanwhile
+    """
+    ordered, quantities = quantities, dict(quantities)
+    errors = {}
+    for change in changes:
+        item = items.get(change["slug"])
+        if item is None:
+            errors[change["slug"]] = _("Item does not exist")
+            continue
+        quantity = quantities.get(item.pk, 0)
+        if change["action"] == "add":
+            quantity += change["quantity"]
+        elif change["action"] == "set":
+            quantity = change["quantity"]
+        else:
+            quantity = 0
+        if quantity > ordered.get(item.pk, 0) and quantity > available[item.pk]:
+            errors[change["slug"]] = _("Order quantity exceeds item stock")
+            continue
+        quantities[item.pk] = quantity
+    return quantities, errors
+
+
+def get_available(items, order_id):
+    """{item id: stock not held for orders other than order_id} of items"""
+    reserved = Reservation.objects.get_reserved(
+        [item.pk for item in items], exclude_order=order_id
+    )
+    return {item.pk: item.stock - reserved.get(item.pk, 0) for item in items}
+
+
+def update_cart(request, changes):
+    """
+    Apply all changes to cart in one transaction, or none of them
+    if any fails. Returns errors by slug
+    """
+    slugs = {change["slug"] for change in changes}
+    if not request.user.is_authenticated:
+        items = {item.slug: item for item in Item.objects.filter(slug__in=slugs)}
+        cart = SessionCart(request)
+        quantities, errors = apply_changes(
+            {int(pk): quantity for pk, quantity in cart.lines.items()},
+            items,
+            changes,
+            get_available(items.values(), get_cart_id(request)),
+        )
+        if not errors:
+            cart.lines = {
+                str(pk): quantity for pk, quantity in quantities.items() if quantity
+            }
+            cart.save()
+        return errors
+    try:
+        return update_order(request, slugs, changes)
+    except IntegrityError:
+        # Line created by a concurrent add to cart, which does not lock the
+        # order. Its line is committed, so the second attempt sees it
+        return update_order(request, slugs, changes)
+
+
+def update_order(request, slugs, changes):
+    """Apply changes to open order of user, see update_cart()"""
+    with transaction.atomic():
+        # Locks the order row, so concurrent batches of the same cart wait for
+        # each other. An UPDATE, as SQLite fails a read lock raised to write
+        Order.objects.filter(**get_cart_owner(request)).update(
+            start_date=F("start_date")
+        )
+        order = Order.objects.get_or_create(**get_cart_owner(request))[0]
+        # Item rows are locked in pk order, like in Reservation.objects.reserve()
+        items = {
+            item.slug: item
+            for item in Item.objects.select_for_update(
+                no_key=connection.features.has_select_for_no_key_update
+            )
+            .filter(slug__in=slugs)
+            .order_by("pk")
+        }
+        lines = {line.item_id: line for line in order.orderitem_set.select_for_update()}
+        quantities, errors = apply_changes(
+            {pk: line.quantity for pk, line in lines.items()},
+            items,
+            changes,
+            get_available(items.values(), order.pk),
+        )
+        if errors:
+            transaction.set_rollback(True)
+            return errors
+        OrderItem.objects.filter(
+            order=order,
+            item__in=[pk for pk, quantity in quantities.items() if not quantity],
+        ).delete()
+        updated = []
+        for pk, line in lines.items():
+            if quantities[pk] and quantities[pk] != line.quantity:
+                line.quantity = quantities[pk]
+                updated.append(line)
+        OrderItem.objects.bulk_update(updated, ["quantity"])
+        OrderItem.objects.bulk_create(
+            OrderItem(order=order, item_id=pk, quantity=quantity)
+            for pk, quantity in quantities.items()
+            if quantity and pk not in lines
+        )
+        refresh_cart_count(request)
+    return {}
+
+
+def raise_quantity(order_id, item):
+    """
+    Raise quantity of item in order by one in a single UPDATE of the line,
+    only while it is below stock. The guard is on the updated row itself,
+    so a request that waited for the row lock checks it again on the new
+    quantity. Number of lines updated
+    """
+    return OrderItem.objects.filter(
+        order_id=order_id,
+        item=item,
+        quantity__lt=Subquery(
+            Item.objects.filter(pk=OuterRef("item_id")).values("stock")
+        ),
+    ).update(quantity=F("quantity") + 1)
+
+
+def add_to_order(request, item):
+    """
+    Raise quantity of item in open order of user by one, creating order and
+    order item if needed. Concurrent requests neither lose updates nor
+    exceed stock
+    """
+    # Read before the transaction, SQLite fails a read lock raised to write.
+    # The UPDATE runs even without a cart to take the write lock first
+    order_id = get_cart_id(request)
+    with transaction.atomic():
+        if raise_quantity(order_id, item):
+            return True
+        # Unique constraints make concurrent creations fall back to get
+        order, order_created = Order.objects.get_or_create(**get_cart_owner(request))
+        created = OrderItem.objects.get_or_create(item=item, order=order)[1]
+        if not created:
+            # Added by another request since the cart was looked up
+            return bool(raise_quantity(order.pk, item))
+        if order_created:
+            set_cart_count(request, 1)
+        else:
+            refresh_cart_count(request)
+        return True
+
+
+def remove_from_order(request, item):
+    """Remove item from open order of user in a single DELETE"""
+    with transaction.atomic():
+        deleted = get_cart_items(request).filter(item=item).delete()[0]
+        if deleted:
+            refresh_cart_count(request)
+    return bool(deleted)
+
+
+def decrement_in_order(request, item):
+    """
+    Lower quantity of item in open order of user by one in a single UPDATE,
+    remove it if only one is left
+    """
+    order_id = get_cart_id(request)
+    if order_id is None:
+        return False
+    order_items = OrderItem.objects.filter(order_id=order_id, item=item)
+    with transaction.atomic():
+        if order_items.filter(quantity__gt=1).update(quantity=F("quantity") - 1):
+            return True
+        deleted = order_items.filter(quantity__lte=1).delete()[0]
+        if deleted:
+            refresh_cart_count(request)
+    return bool(deleted)
+
+
+def has_cart(request):
+    """Whether user or anonymous visitor has anything in cart"""
+    if request.user.is_authenticated:
+        return Order.objects.filter(**get_cart_owner(request)).exists()
+    return bool(SessionCart(request))
 
 
 def add_to_cart(request, slug):
     """
-    Add item to order. If order does not exist, create new one.
-    If user is authenticated, order.user will be filled.
-    If user is anon, order.session_key will be used
+    Add item to cart. Cart of authenticated user is an order,
+    cart of anonymous visitor is kept in session until checkout
     """
     item = get_object_or_404(Item, slug=slug)
     if item.stock <= 0:
         messages.warning(request, _("Unfortunately we do not have item on stock"))
         return redirect("core:product", slug=slug)
-    if not request.user.is_authenticated and not request.session.exists(
-        request.session.session_key
-    ):
-        request.session.create()
-    order = Order.objects.filter(
-        ordered=False,
-        user=(request.user if request.user.is_authenticated else None),
-        session_key=(
-            None if request.user.is_authenticated else request.session.session_key
-        ),
-    ).first()
-    if order is not None:
-        order_item, created = OrderItem.objects.get_or_create(item=item, order=order)
-        if not created:
-            order_item.quantity += 1
-            if order_item.quantity > item.stock:
-                messages.warning(
-                    request,
-                    _("Unfortunately we do not have this " + "quantity on stock"),
-                )
-                return redirect("order:cart-summary")
-
-            order_item.save()
-            messages.info(request, _("Quantity was updated"))
-            return redirect("order:cart-summary")
-        messages.info(request, _("Quantity was updated"))
+    if request.user.is_authenticated:
+        added = add_to_order(request, item)
+    else:
+        added = SessionCart(request).add(item)
+    if not added:
+        messages.warning(
+            request,
+            _("Unfortunately we do not have this " + "quantity on stock"),
+        )
         return redirect("order:cart-summary")
-
-    order = Order.objects.create(
-        user=request.user if request.user.is_authenticated else None,
-        start_date=timezone.now(),
-        session_key=(
-            None if request.user.is_authenticated else request.session.session_key
-        ),
-    )
-    order_item = OrderItem.objects.create(item=item, order=order)
     messages.info(request, _("Quantity was updated"))
     return redirect("order:cart-summary")
 
 
 def remove_from_cart(request, slug):
     item = get_object_or_404(Item, slug=slug)
-    order = (
-        Order.objects.filter(
-            ordered=False,
-            user=(request.user if request.user.is_authenticated else None),
-            session_key=(
-                None if request.user.is_authenticated else request.session.session_key
-            ),
-        )
-        .prefetch_related(
-            Prefetch("orderitem_set", queryset=OrderItem.objects.filter(item=item))
-        )
-        .first()
-    )
-    if order is not None:
-        order_item = order.orderitem_set.first()
-
-        if order_item is not None:
-            order_item.delete()
-            messages.info(request, _("This item was removed from your cart"))
-            return redirect("order:cart-summary")
+    if request.user.is_authenticated:
+        removed = remove_from_order(request, item)
+    else:
+        removed = SessionCart(request).remove(item)
+    if removed:
+        messages.info(request, _("This item was removed from your cart"))
+        return redirect("order:cart-summary")
 
+    if has_cart(request):
         messages.warning(request, _("This item was not in your cart"))
         return redirect("core:product", slug=slug)
 
@@ -90,30 +436,15 @@ def remove_from_cart(request, slug):
 
 def remove_single_item_from_cart(request, slug):
     item = get_object_or_404(Item, slug=slug)
-    order = (
-        Order.objects.filter(
-            ordered=False,
-            user=(request.user if request.user.is_authenticated else None),
-            session_key=(
-                None if request.user.is_authenticated else request.session.session_key
-            ),
-        )
-        .prefetch_related(
-            Prefetch("orderitem_set", queryset=OrderItem.objects.filter(item=item))
-        )
-        .first()
-    )
-    if order is not None:
-        order_item = order.orderitem_set.all().first()
-        if order_item is not None:
-            if order_item.quantity <= 1:
-                order_item.delete()
-            else:
-                order_item.quantity -= 1
-                order_item.save()
-            messages.info(request, _("This item quantity was updated"))
-            return redirect("order:cart-summary")
+    if request.user.is_authenticated:
+        updated = decrement_in_order(request, item)
+    else:
+        updated = SessionCart(request).decrement(item)
+    if updated:
+        messages.info(request, _("This item quantity was updated"))
+        return redirect("order:cart-summary")
 
+    if has_cart(request):
         messages.info(request, _("This item was not in your cart"))
         return redirect("core:product", slug=slug)
 
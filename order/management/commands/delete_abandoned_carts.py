@@ -0,0 +1,123 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from order.models import Order
+
+# Longest a batch waits for a row lock on Postgres before it is skipped
+LOCK_TIMEOUT_MS = 500
+
+
+class Command(BaseCommand):
+    """Delete open carts nobody can get back to, in small batches"""
+
+    help = (
+        "Delete unordered carts of anonymous sessions older than the session "
+        "cookie age and, if --user-days is given, stale carts of users"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.SESSION_COOKIE_AGE // (60 * 60 * 24),
+            help="Age of anonymous carts to delete, their sessions are gone by then",
+        )
+        parser.add_argument(
+            "--user-days",
+            type=int,
+            default=None,
+            help="Age of carts of users to delete, kept if not given",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=1000, help="Carts deleted per transaction"
+        )
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=0,
+            help="Seconds to pause between batches",
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Only count carts to delete"
+        )
+
+    def handle(self, *args, **options):
+        self.started = time.monotonic()
+        self.carts = self.rows = 0
+        now = timezone.now()
+        self.delete(
+            Q(user__isnull=True), now - timedelta(days=options["days"]), options
+        )
+        if options["user_days"] is not None:
+            self.delete(
+                Q(user__isnull=False),
+                now - timedelta(days=options["user_days"]),
+                options,
+            )
+        action = "Would delete" if options["dry_run"] else "Deleted"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{action} {self.carts} carts, {self.rows} rows, "
+                f"{self.get_rate():.1f} rows/s"
+            )
+        )
+
+    def get_rate(self):
+        """Deleted rows per second"""
+        return self.rows / max(time.monotonic() - self.started, 1e-6)
+
+    def delete(self, owner, cutoff, options):
+        """
+        Delete open carts of owner started before cutoff. Batches walk the
+        partial index on (start_date, id) from where the last one ended
+        """
+        carts = Order.objects.filter(owner, ordered=False, start_date__lt=cutoff)
+        if options["dry_run"]:
+            self.carts += carts.count()
+            return
+        last = None
+        while True:
+            batch = carts.order_by("start_date", "id")
+            if last is not None:
+                batch = batch.filter(
+                    Q(start_date__gt=last[0]) | Q(start_date=last[0], id__gt=last[1])
+                )
+            previous = last
+            try:
+                with transaction.atomic():
+                    if connection.vendor == "postgresql":
+                        with connection.cursor() as cursor:
+                            cursor.execute(
+                                f"SET LOCAL lock_timeout = {LOCK_TIMEOUT_MS:d}"
+                            )
+                    # Carts being changed right now are left for the next run
+                    rows = list(
+                        batch.select_for_update(
+                            skip_locked=True, of=("self",)
+                        ).values_list("start_date", "id")[: options["batch_size"]]
+                    )
+                    if not rows:
+                        return
+                    last = rows[-1]
+                    deleted = Order.objects.filter(
+                        pk__in=[pk for _, pk in rows], ordered=False
+                    ).delete()[0]
+            except OperationalError as error:
+                if last == previous:  # Failed before the batch was read
+                    raise
+                # Lock timeout while deleting, batch is left for the next run
+                self.stderr.write(f"Skipped carts up to {last[1]}: {error}")
+                continue
+            self.carts += len(rows)
+            self.rows += deleted
+            self.stdout.write(
+                f"{self.carts} carts deleted, {self.get_rate():.1f} rows/s"
+            )
+            if options["sleep"]:
+                time.sleep(options["sleep"])
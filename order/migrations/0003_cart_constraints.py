@@ -0,0 +1,62 @@
+# Generated by Django 4.0.6 on 2026-10-18 10:40
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def merge_duplicates(apps, schema_editor):
+    """Merge open carts of the same owner into the newest one, then equal lines"""
+    Order = apps.get_model("order", "Order")
+    OrderItem = apps.get_model("order", "OrderItem")
+    for owner in ("user", "session_key"):
+        duplicates = (
+            Order.objects.filter(ordered=False, **{f"{owner}__isnull": False})
+            .values(owner)
+            .annotate(carts=Count("id"))
+            .filter(carts__gt=1)
+            .values_list(owner, flat=True)
+        )
+        for value in duplicates:
+            newest, *older = Order.objects.filter(
+                ordered=False, **{owner: value}
+            ).order_by("-start_date", "-id")
+            OrderItem.objects.filter(order__in=older).update(order=newest)
+            Order.objects.filter(pk__in=[order.pk for order in older]).delete()
+    duplicates = (
+        OrderItem.objects.values("order", "item")
+        .annotate(lines=Count("id"), total=Sum("quantity"))
+        .filter(lines__gt=1)
+    )
+    for line in duplicates:
+        kept, *merged = OrderItem.objects.filter(
+            order=line["order"], item=line["item"]
+        ).order_by("id")
+        OrderItem.objects.filter(pk=kept.pk).update(quantity=line["total"])
+        OrderItem.objects.filter(pk__in=[item.pk for item in merged]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0002_alter_order_address'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='order',
+            unique_together=set(),
+        ),
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(('ordered', False), ('user__isnull', False)), fields=('user',), name='order_order_open_cart_user_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(('ordered', False), ('session_key__isnull', False)), fields=('session_key',), name='order_order_open_cart_session_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='orderitem',
+            constraint=models.UniqueConstraint(fields=('order', 'item'), name='order_orderitem_order_item_uniq'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.0.6 on 2026-10-18 10:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0003_cart_constraints'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('ordered', False)), fields=['start_date', 'id'], name='order_order_open_start_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.0.6 on 2026-10-18 10:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_image_placeholders'),
+        ('order', '0004_open_cart_start_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Reservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(verbose_name='Menge')),
+                ('expires_at', models.DateTimeField(verbose_name='Expires at')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.item', verbose_name='Artikel')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='order.order', verbose_name='Bestellung')),
+            ],
+            options={
+                'verbose_name': 'Reservation',
+                'verbose_name_plural': 'Reservations',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['item', 'expires_at', 'quantity'], name='order_reservation_item_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='reservation',
+            constraint=models.UniqueConstraint(fields=('order', 'item'), name='order_reservation_order_item_uniq'),
+        ),
+    ]
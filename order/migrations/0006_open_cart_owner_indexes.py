@@ -0,0 +1,29 @@
+# Generated by Django 4.0.6 on 2026-10-18 10:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("order", "0005_reservation"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                condition=models.Q(("ordered", False), ("user__isnull", False)),
+                fields=["user", "session_key", "start_date", "id", "ordered"],
+                name="order_order_open_user_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                condition=models.Q(("ordered", False), ("session_key__isnull", False)),
+                fields=["session_key", "user", "start_date", "id", "ordered"],
+                name="order_order_open_session_idx",
+            ),
+        ),
+    ]
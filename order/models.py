@@ -1,11 +1,16 @@
 from functools import cached_property
 
+from datetime import timedelta
 from decimal import Decimal
 from django.conf import settings
+from django.contrib.auth.signals import user_logged_in
 from django.core import mail
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import Case, Count, F, Max, Sum, Value, When
+from django.db.models.functions import Coalesce, Round
 from django.dispatch import receiver
 from django.template.loader import render_to_string
+from django.utils import timezone
 from django.utils.html import strip_tags
 from django.utils.translation import gettext as _
 
@@ -34,6 +39,11 @@ class OrderItem(models.Model):
     class Meta:
         verbose_name = _("Cart Item")
         verbose_name_plural = _("Cart Items")
+        constraints = [
+            models.UniqueConstraint(
+                fields=["order", "item"], name="order_orderitem_order_item_uniq"
+            ),
+        ]
 
     def __str__(self):
         return f"{self.item.title}: {self.quantity}"
@@ -49,6 +59,62 @@ class OrderItem(models.Model):
         return self.quantity * self.item.discount
 
 
+# Delivery of orders with several items is the highest delivery price plus 20%
+MULTI_ITEM_DELIVERY_RATE = Decimal("1.2")
+# Annotations of OrderQuerySet.with_totals()
+TOTAL_FIELDS = ("line_count", "subtotal", "delivery_total", "savings", "total")
+
+
+def money(expression):
+    """Expression as an amount in euro"""
+    return Coalesce(
+        expression,
+        Value(Decimal(0)),
+        output_field=models.DecimalField(max_digits=12, decimal_places=2),
+    )
+
+
+class OrderQuerySet(models.QuerySet):
+    """Order queryset computing totals in SQL"""
+
+    def with_totals(self):
+        """
+        Orders annotated with number of lines, subtotal without delivery,
+        delivery total, savings and grand total, all in the same query
+        """
+        return (
+            self.annotate(
+                line_count=Count("orderitem"),
+                subtotal=money(
+                    Sum(
+                        F("orderitem__quantity")
+                        * F("orderitem__item__price_no_delivery")
+                    )
+                ),
+                max_delivery=money(Max("orderitem__item__delivery_price")),
+                savings=money(
+                    Sum(F("orderitem__quantity") * F("orderitem__item__discount"))
+                ),
+            )
+            .annotate(
+                delivery_total=money(
+                    Case(
+                        When(
+                            line_count__gt=1,
+                            then=Round(
+                                F("max_delivery") * Value(MULTI_ITEM_DELIVERY_RATE), 2
+                            ),
+                        ),
+                        default=F("max_delivery"),
+                    )
+                ),
+            )
+            .annotate(
+                total=money(F("subtotal") + F("delivery_total")),
+            )
+        )
+
+
 class Order(models.Model):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True
@@ -105,7 +171,77 @@ class Order(models.Model):
         verbose_name = _("Order")
         verbose_name_plural = _("Orders")
         ordering = ("-start_date",)
-        unique_together = ("user", "session_key")
+        indexes = [
+            # Open carts by age for delete_abandoned_carts, orders stay out of it
+            models.Index(
+                fields=["start_date", "id"],
+                condition=models.Q(ordered=False),
+                name="order_order_open_start_idx",
+            ),
+            # Open cart lookups by owner, answered without reading the table
+            # and already sorted for the default ordering. ordered is implied
+            # by the condition but SQLite reads it unless the index holds it
+            models.Index(
+                fields=["user", "session_key", "start_date", "id", "ordered"],
+                condition=models.Q(ordered=False, user__isnull=False),
+                name="order_order_open_user_idx",
+            ),
+            models.Index(
+                fields=["session_key", "user", "start_date", "id", "ordered"],
+                condition=models.Q(ordered=False, session_key__isnull=False),
+                name="order_order_open_session_idx",
+            ),
+        ]
+        # NULLs are distinct in unique indexes, so open carts of users and
+        # of anonymous sessions are constrained separately
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user"],
+                condition=models.Q(ordered=False, user__isnull=False),
+                name="order_order_open_cart_user_uniq",
+            ),
+            models.UniqueConstraint(
+                fields=["session_key"],
+                condition=models.Q(ordered=False, session_key__isnull=False),
+                name="order_order_open_cart_session_uniq",
+            ),
+        ]
+
+    objects = OrderQuerySet.as_manager()
+
+    def get_totals(self):
+        """
+        Annotations of Order.objects.with_totals(),
+        queried once if order was not loaded with them
+        """
+        if not hasattr(self, "total"):
+            totals = (
+                Order.objects.with_totals()
+                .filter(pk=self.pk)
+                .values(*TOTAL_FIELDS)
+                .get()
+            )
+            for name, value in totals.items():
+                setattr(self, name, value)
+        return {name: getattr(self, name) for name in TOTAL_FIELDS}
+
+    def set_totals(self, order_items):
+        """Totals of unsaved order from its order items, as with_totals() computes them"""
+        self.line_count = len(order_items)
+        self.subtotal = sum(
+            (line.quantity * line.item.price_no_delivery for line in order_items),
+            Decimal(0),
+        )
+        self.savings = sum(
+            (line.quantity * line.item.discount for line in order_items), Decimal(0)
+        )
+        max_delivery = max(
+            (line.item.delivery_price for line in order_items), default=Decimal(0)
+        )
+        if self.line_count > 1:
+            max_delivery = round(max_delivery * MULTI_ITEM_DELIVERY_RATE, 2)
+        self.delivery_total = max_delivery
+        self.total = self.subtotal + self.delivery_total
 
     @cached_property
     def get_delivery_total(self):
@@ -113,30 +249,158 @@ class Order(models.Model):
         Delivery cost is not simply added up, but rather
         the max of the order items is taken with additional 20%
         """
-        order_items = OrderItem.objects.filter(order=self.id).select_related("item")
-        if order_items.count() > 1:
-            item_delivery = []
-            for item in order_items:
-                item_delivery.append(item.item.delivery_price)
-            delivery = round(Decimal(max(item_delivery)) * Decimal(1.2), 2)
-        else:
-            delivery = order_items[0].item.delivery_price
-        return delivery
+        return self.get_totals()["delivery_total"]
 
     @cached_property
     def get_total(self):
         """Total order amount"""
-        order_items = OrderItem.objects.filter(order=self.id).select_related("item")
-        total = 0
-        for item in order_items:
-            total += item.item.get_price_no_delivery * item.quantity
-        total += self.get_delivery_total
-        return total
+        return self.get_totals()["total"]
 
     @cached_property
     def get_price_no_delivery(self):
         """Order amount without delivery"""
-        return self.get_total - self.get_delivery_total
+        return self.get_totals()["subtotal"]
+
+    @cached_property
+    def get_saving(self):
+        """Total saving of order"""
+        return self.get_totals()["savings"]
+
+
+class ReservationQuerySet(models.QuerySet):
+    """Stock held for orders between checkout and payment"""
+
+    def active(self):
+        """Reservations not expired yet"""
+        return self.filter(expires_at__gt=timezone.now())
+
+    def sum_by_item(self):
+        """(item id, reserved quantity) of active reservations"""
+        return (
+            self.active()
+            .values("item")
+            .annotate(reserved=Sum("quantity"))
+            .values_list("item", "reserved")
+        )
+
+    def get_reserved(self, item_ids, exclude_order=None):
+        """{item id: quantity held by active reservations} of items"""
+        reservations = self.filter(item__in=item_ids)
+        if exclude_order is not None:
+            reservations = reservations.exclude(order=exclude_order)
+        return dict(reservations.sum_by_item())
+
+    def reserve(self, order):
+        """
+        Hold stock of order items for settings.STOCK_RESERVATION_TTL seconds,
+        replacing earlier holds of order. Returns items without enough stock
+        available, in which case nothing is held
+        """
+        order_items = list(order.orderitem_set.select_related("item"))
+        item_model = self.model._meta.get_field("item").related_model
+        now = timezone.now()
+        with transaction.atomic():
+            # Locking rows of these items serializes holds of the same item,
+            # the item table itself stays unlocked
+            stock = dict(
+                item_model.objects.select_for_update(
+                    no_key=connection.features.has_select_for_no_key_update
+                )
+                .filter(pk__in=[line.item_id for line in order_items])
+                .order_by("pk")
+                .values_list("pk", "stock")
+            )
+            self.filter(item__in=stock, expires_at__lte=now).delete()
+            reserved = self.get_reserved(stock, exclude_order=order)
+            short = [
+                line.item
+                for line in order_items
+                if line.quantity > stock[line.item_id] - reserved.get(line.item_id, 0)
+            ]
+            if short:
+                return short
+            self.filter(order=order).delete()
+            expires_at = now + timedelta(seconds=settings.STOCK_RESERVATION_TTL)
+            self.bulk_create(
+                self.model(
+                    order=order,
+                    item_id=line.item_id,
+                    quantity=line.quantity,
+                    expires_at=expires_at,
+                )
+                for line in order_items
+            )
+        return []
+
+    def take(self, order):
+        """
+        Take held stock once order is paid: lower stock of its items and
+        drop its holds. Item rows are locked in the same order as in
+        reserve(), so the two never deadlock
+        """
+        quantities = dict(order.orderitem_set.values_list("item", "quantity"))
+        item_model = self.model._meta.get_field("item").related_model
+        with transaction.atomic():
+            items = item_model.objects.filter(pk__in=quantities)
+            list(
+                items.select_for_update(
+                    no_key=connection.features.has_select_for_no_key_update
+                )
+                .order_by("pk")
+                .values_list("pk")
+            )
+            items.update(
+                stock=F("stock")
+                - Case(
+                    *(
+                        When(pk=pk, then=Value(quantity))
+                        for pk, quantity in quantities.items()
+                    )
+                ),
+                ordered_counter=F("ordered_counter") + 1,
+                updated_date=timezone.now(),
+            )
+            self.filter(order=order).delete()
+
+
+class Reservation(models.Model):
+    """
+    Stock of an item held for an order until it expires. Available stock
+    of an item is its stock less its active reservations
+    """
+
+    order = models.ForeignKey(
+        Order,
+        related_name="reservations",
+        on_delete=models.CASCADE,
+        verbose_name=_("Order"),
+    )
+    item = models.ForeignKey(
+        "core.Item", on_delete=models.CASCADE, verbose_name=_("Item")
+    )
+    quantity = models.PositiveIntegerField(verbose_name=_("Quantity"))
+    expires_at = models.DateTimeField(verbose_name=_("Expires at"))
+
+    objects = ReservationQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = _("Reservation")
+        verbose_name_plural = _("Reservations")
+        constraints = [
+            models.UniqueConstraint(
+                fields=["order", "item"], name="order_reservation_order_item_uniq"
+            ),
+        ]
+        indexes = [
+            # Reserved quantity of an item is summed from this index alone
+            models.Index(
+                fields=["item", "expires_at", "quantity"],
+                name="order_reservation_item_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.item_id}: {self.quantity}"
 
 
 @receiver(models.signals.post_save, sender=Order)
@@ -192,3 +456,12 @@ def hear_signal(sender, instance, **kwargs):  # pylint: disable=unused-argument
             message="",
             fail_silently=False,
         )
+
+
+@receiver(user_logged_in)
+def merge_cart(sender, request, user, **kwargs):  # pylint: disable=unused-argument
+    """Move cart kept in session while anonymous into cart of user"""
+    from .cart import merge_session_cart  # pylint: disable=import-outside-toplevel
+
+    if request is not None:
+        merge_session_cart(request, user)
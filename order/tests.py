@@ -1,3 +1,501 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from types import SimpleNamespace
+from unittest.mock import patch
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import Client, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from core.models import Item
+from .cart import (
+    SessionCart,
+    get_cart_count,
+    get_cart_count_key,
+    get_cart_items,
+    get_cart_owner,
+)
+from .models import TOTAL_FIELDS, Order, OrderItem, Reservation
+
+
+class CartCountTestCase(TestCase):
+    """Testing cached cart badge count"""
+
+    def setUp(self):
+        cache.clear()
+        self.toy, self.book = (
+            Item.objects.create(
+                title=title,
+                price=100,
+                title_image=f"items/{title}.webp",
+                description="this is our new toy",
+            )
+            for title in ("toy", "book")
+        )
+        self.user = User.objects.create_user("buyer", "buyer@example.com")
+        self.client.force_login(self.user)
+        return super().setUp()
+
+    def get_request(self):
+        """Request of test client's user"""
+        return SimpleNamespace(user=self.user, session=self.client.session)
+
+    def get_count(self):
+        """Cart count of test client's user"""
+        return get_cart_count(self.get_request())
+
+    def test_count_follows_cart(self):
+        """Cart functions keep count up to date, reading it needs no query"""
+        self.assertEqual(self.get_count(), 0)
+        self.client.get(reverse("order:add-to-cart", kwargs={"slug": self.toy.slug}))
+        self.client.get(reverse("order:add-to-cart", kwargs={"slug": self.toy.slug}))
+        self.client.get(reverse("order:add-to-cart", kwargs={"slug": self.book.slug}))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_count(), 2)
+        self.client.get(
+            reverse("order:remove-from-cart", kwargs={"slug": self.book.slug})
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_count(), 1)
+
+    def test_recount_on_miss(self):
+        """Evicted count is counted again"""
+        self.client.get(reverse("order:add-to-cart", kwargs={"slug": self.toy.slug}))
+        cache.delete(get_cart_count_key(self.get_request()))
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_count(), 1)
+
+
+class OrderTotalsTestCase(TestCase):
+    """Testing order totals computed in SQL"""
+
+    def setUp(self):
+        self.items = [
+            Item.objects.create(
+                title=f"toy {number}",
+                price=100,
+                delivery_price=Decimal(delivery_price),
+                discount=10,
+                title_image=f"items/toy{number}.webp",
+                description="this is our new toy",
+            )
+            for number, delivery_price in enumerate(("4.99", "7.45", "2.00"))
+        ]
+        return super().setUp()
+
+    def test_single_item(self):
+        """Delivery of a single item is its delivery price"""
+        order = Order.objects.create()
+        OrderItem.objects.create(order=order, item=self.items[0], quantity=2)
+        order = Order.objects.with_totals().get()
+        self.assertEqual(order.get_price_no_delivery, Decimal("180.00"))
+        self.assertEqual(order.get_delivery_total, Decimal("4.99"))
+        self.assertEqual(order.get_total, Decimal("184.99"))
+        self.assertEqual(order.get_saving, Decimal("20.00"))
+
+    def test_several_items(self):
+        """Delivery of several items is the highest delivery price plus 20%"""
+        order = Order.objects.create()
+        for item in self.items:
+            OrderItem.objects.create(order=order, item=item)
+        order = Order.objects.get()
+        with self.assertNumQueries(1):
+            totals = order.get_totals()
+            self.assertEqual(order.get_total, totals["total"])
+        self.assertEqual(totals["line_count"], 3)
+        self.assertEqual(totals["delivery_total"], Decimal("8.94"))
+        self.assertEqual(totals["total"], Decimal("278.94"))
+
+    def test_cart_summary_queries(self):
+        """Cart summary costs the same number of queries for any number of items"""
+        self.client.force_login(User.objects.create_user("buyer"))
+        queries = []
+        for item in self.items:
+            self.client.get(reverse("order:add-to-cart", kwargs={"slug": item.slug}))
+            self.client.get(reverse("order:cart-summary"))  # Warm up cached site
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(reverse("order:cart-summary"))
+            queries.append(len(context.captured_queries))
+        self.assertEqual(response.context["order"].total, Decimal("278.94"))
+        # User, order with totals, its order items and their items
+        self.assertEqual(queries, [4, 4, 4])
+
+
+class CartConcurrencyTestCase(TransactionTestCase):
+    """Testing cart mutations under concurrent requests"""
+
+    def setUp(self):
+        self.toy = Item.objects.create(
+            title="toy",
+            price=100,
+            stock=5,
+            title_image="items/toy.webp",
+            description="this is our new toy",
+        )
+        # Session of user shared by all threads, no cart yet
+        self.client.force_login(User.objects.create_user("buyer"))
+        return super().setUp()
+
+    def hammer(self, url_name, threads=20):
+        """Request url_name for toy from many threads of the same user"""
+        url = reverse(url_name, kwargs={"slug": self.toy.slug})
+        self.run_concurrently(lambda client: client.get(url), threads)
+
+    def run_concurrently(self, send, threads):
+        """Call send with a client of the same user from many threads at once"""
+        cookies = self.client.cookies
+        barrier = threading.Barrier(threads)
+        errors = []
+
+        def request():
+            client = Client()
+            client.cookies = cookies
+            barrier.wait()
+            try:
+                send(client)
+            except Exception as error:  # pylint: disable=broad-except
+                errors.append(error)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=request) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(errors, [])
+
+    def test_add_loses_no_updates(self):
+        """Every concurrent add raises quantity by one"""
+        Item.objects.filter(pk=self.toy.pk).update(stock=50)
+        self.hammer("order:add-to-cart")
+        self.assertEqual(OrderItem.objects.get().quantity, 20)
+
+    def test_add_never_exceeds_stock(self):
+        """Concurrent adds create one cart with one line filled up to stock"""
+        self.hammer("order:add-to-cart")
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(OrderItem.objects.get().quantity, 5)
+
+    def test_batches_add_same_item(self):
+        """Concurrent batches adding the same new item are all applied"""
+        Item.objects.filter(pk=self.toy.pk).update(stock=50)
+        url = reverse("cart")
+        changes = {"changes": [{"slug": self.toy.slug}]}
+
+        def send(client):
+            response = client.post(url, changes, content_type="application/json")
+            self.assertEqual(response.status_code, 200)
+
+        self.run_concurrently(send, threads=10)
+        self.assertEqual(OrderItem.objects.get().quantity, 10)
+
+    def test_decrement_never_below_zero(self):
+        """Concurrent decrements empty the line and remove it once"""
+        self.client.get(reverse("order:add-to-cart", kwargs={"slug": self.toy.slug}))
+        OrderItem.objects.update(quantity=3)
+        self.hammer("order:remove-single-item-from-cart")
+        self.assertFalse(OrderItem.objects.exists())
+
+
+class SessionCartTestCase(TestCase):
+    """Testing cart of anonymous visitors kept in session"""
+
+    def setUp(self):
+        self.toy, self.book = (
+            Item.objects.create(
+                title=title,
+                price=100,
+                delivery_price=Decimal("4.99"),
+                discount=5,
+                stock=2,
+                title_image=f"items/{title}.webp",
+                description="this is our new toy",
+            )
+            for title in ("toy", "book")
+        )
+        return super().setUp()
+
+    def add(self, item):
+        """Add item to cart of test client"""
+        self.client.get(reverse("order:add-to-cart", kwargs={"slug": item.slug}))
+
+    def get_cart(self):
+        """Session cart of test client"""
+        return SessionCart(
+            SimpleNamespace(user=AnonymousUser(), session=self.client.session)
+        )
+
+    def test_no_rows_until_checkout(self):
+        """Anonymous cart writes no orders, checkout writes them with equal totals"""
+        for item in (self.toy, self.toy, self.toy, self.book):
+            self.add(item)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(
+            self.get_cart().lines, {str(self.toy.pk): 2, str(self.book.pk): 1}
+        )
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.get_cart()), 2)
+            order = self.get_cart().get_order()[0]
+        self.client.post(
+            reverse("checkout:checkout"),
+            {
+                "email": "buyer@example.com",
+                "shipping_name": "Buyer",
+                "shipping_street_address": "Street 1",
+                "shipping_city": "Ladenburg",
+                "shipping_country": "DE",
+                "shipping_zip": "68526",
+                "billing_name": "Buyer",
+                "billing_street_address": "Street 1",
+                "billing_city": "Ladenburg",
+                "billing_country": "DE",
+                "billing_zip": "68526",
+            },
+        )
+        saved = Order.objects.with_totals().get()
+        self.assertEqual(saved.session_key, self.client.session.session_key)
+        self.assertIsNotNone(saved.address)
+        for name in TOTAL_FIELDS:
+            self.assertEqual(getattr(saved, name), getattr(order, name))
+
+    def test_merge_on_login(self):
+        """Session cart is added to cart of user logging in, up to stock"""
+        user = User.objects.create_user("buyer", "buyer@example.com", "secret")
+        order = Order.objects.create(user=user)
+        OrderItem.objects.create(order=order, item=self.toy, quantity=1)
+        self.add(self.toy)
+        self.add(self.toy)
+        self.add(self.book)
+        self.client.login(username="buyer", password="secret")
+        self.assertEqual(
+            dict(order.orderitem_set.values_list("item", "quantity")),
+            {self.toy.pk: 2, self.book.pk: 1},
+        )
+        self.assertEqual(len(self.get_cart()), 0)
+
+
+class AbandonedCartsTestCase(TestCase):
+    """Testing deletion of abandoned carts"""
+
+    def setUp(self):
+        toy = Item.objects.create(
+            title="toy",
+            price=100,
+            title_image="items/toy.webp",
+            description="this is our new toy",
+        )
+        user = User.objects.create_user("buyer")
+        self.orders = {}
+        for name, days, owner, ordered in (
+            ("old", 30, {"session_key": "old"}, False),
+            ("older", 40, {"session_key": "older"}, False),
+            ("recent", 1, {"session_key": "recent"}, False),
+            ("user", 30, {"user": user}, False),
+            ("ordered", 40, {"session_key": "ordered"}, True),
+        ):
+            order = Order.objects.create(ordered=ordered, **owner)
+            Order.objects.filter(pk=order.pk).update(
+                start_date=timezone.now() - timedelta(days=days)
+            )
+            OrderItem.objects.create(order=order, item=toy)
+            self.orders[name] = order
+        return super().setUp()
+
+    def get_remaining(self):
+        """Names of orders left"""
+        pks = set(Order.objects.values_list("pk", flat=True))
+        return {name for name, order in self.orders.items() if order.pk in pks}
+
+    def test_anonymous_carts(self):
+        """Old anonymous carts are deleted in batches with their items"""
+        out = StringIO()
+        call_command("delete_abandoned_carts", "--batch-size", "1", stdout=out)
+        self.assertEqual(self.get_remaining(), {"recent", "user", "ordered"})
+        self.assertEqual(OrderItem.objects.count(), 3)
+        self.assertIn("Deleted 2 carts, 4 rows", out.getvalue())
+
+    def test_user_carts(self):
+        """Carts of users are only deleted if asked for"""
+        call_command("delete_abandoned_carts", "--user-days", "20", stdout=StringIO())
+        self.assertEqual(self.get_remaining(), {"recent", "ordered"})
+
+
+class CartLookupPlanTestCase(TestCase):
+    """Testing open cart lookups are answered from the owner indexes"""
+
+    def setUp(self):
+        if connection.vendor not in ("sqlite", "postgresql"):
+            self.skipTest("Query plans are only checked on SQLite and Postgres")
+        user = User.objects.create_user("buyer", "buyer@example.com")
+        self.requests = {
+            "order_order_open_user_idx": SimpleNamespace(
+                user=user, session=SimpleNamespace(session_key=None)
+            ),
+            "order_order_open_session_idx": SimpleNamespace(
+                user=AnonymousUser(), session=SimpleNamespace(session_key="key")
+            ),
+        }
+        return super().setUp()
+
+    def explain(self, queryset):
+        """Query plan of queryset"""
+        with transaction.atomic():
+            if connection.vendor == "postgresql":
+                # Scanning the few test rows would be cheaper than any index
+                with connection.cursor() as cursor:
+                    cursor.execute("SET LOCAL enable_seqscan = off")
+            return queryset.explain()
+
+    def test_index_only(self):
+        """Cart and its lines are found without reading the order table"""
+        for index, request in self.requests.items():
+            covering = (
+                f"COVERING INDEX {index}"
+                if connection.vendor == "sqlite"
+                else f"Index Only Scan using {index}"
+            )
+            for queryset in (
+                Order.objects.filter(**get_cart_owner(request)).values("id"),
+                get_cart_items(request),
+            ):
+                with self.subTest(index=index, query=str(queryset.query)):
+                    self.assertIn(covering, self.explain(queryset))
+
+    def test_views(self):
+        """Cart lookups of views come from the owner index too"""
+        request = self.requests["order_order_open_user_idx"]
+        Order.objects.create(user=request.user)
+        self.client.force_login(request.user)
+        with CaptureQueriesContext(connection) as queries:
+            for url in (
+                reverse("order:cart-summary"),
+                reverse("cart"),
+                reverse("checkout:checkout"),
+                reverse("payment:payment"),
+            ):
+                self.client.get(url)
+        lookups = [
+            query["sql"]
+            for query in queries
+            if query["sql"].startswith("SELECT")
+            and 'FROM "order_order"' in query["sql"]
+            and '"user_id" = ' in query["sql"]
+        ]
+        self.assertEqual(len(lookups), 4)
+        for sql in lookups:
+            with self.subTest(query=sql):
+                self.assertIn("order_order_open_user_idx", self.explain_sql(sql))
+
+    def explain_sql(self, sql):
+        """Query plan of captured query"""
+        explain = (
+            "EXPLAIN" if connection.vendor == "postgresql" else "EXPLAIN QUERY PLAN"
+        )
+        with transaction.atomic(), connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute(f"{explain} {sql}")
+            return "\n".join(str(row[-1]) for row in cursor.fetchall())
+
+    def test_no_sort(self):
+        """Default ordering of carts comes from the index"""
+        for index, request in self.requests.items():
+            plan = self.explain(Order.objects.filter(**get_cart_owner(request)))
+            with self.subTest(index=index):
+                self.assertIn(index, plan)
+                self.assertNotIn("TEMP B-TREE", plan)
+                self.assertNotIn("Sort", plan)
+
+
+class ReservationTestCase(TestCase):
+    """Testing stock held between checkout and payment"""
+
+    def setUp(self):
+        self.toy = Item.objects.create(
+            title="toy",
+            price=100,
+            stock=1,
+            title_image="items/toy.webp",
+            description="this is our new toy",
+        )
+        self.first, self.second = (
+            Order.objects.create(session_key=key) for key in ("first", "second")
+        )
+        for order in (self.first, self.second):
+            OrderItem.objects.create(order=order, item=self.toy)
+        return super().setUp()
+
+    def test_last_unit(self):
+        """Last unit is held for one order until its hold expires"""
+        self.assertEqual(Reservation.objects.reserve(self.first), [])
+        self.assertEqual(Reservation.objects.reserve(self.second), [self.toy])
+        self.assertEqual(Reservation.objects.reserve(self.first), [])  # Refreshed
+        Reservation.objects.update(expires_at=timezone.now())
+        self.assertEqual(Reservation.objects.reserve(self.second), [])
+        self.assertEqual(
+            list(Reservation.objects.values_list("order", flat=True)),
+            [self.second.pk],
+        )
+
+    def test_take(self):
+        """Paid order takes its held stock"""
+        Reservation.objects.reserve(self.first)
+        Reservation.objects.take(self.first)
+        self.toy.refresh_from_db()
+        self.assertEqual((self.toy.stock, self.toy.ordered_counter), (0, 1))
+        self.assertFalse(Reservation.objects.exists())
+
+    def test_capture_after_hold_expired(self):
+        """Payment is not captured once the expired hold went to another order"""
+        session = self.client.session
+        session.save()
+        Order.objects.filter(pk=self.first.pk).update(session_key=session.session_key)
+        Reservation.objects.reserve(self.first)
+        Reservation.objects.update(expires_at=timezone.now())
+        Reservation.objects.reserve(self.second)
+        with patch("payment.views.PayPalHttpClient.execute") as execute:
+            response = self.client.post(
+                reverse("payment:paypal-capture", kwargs={"order_id": "PAYPAL-1"})
+            )
+        self.assertEqual(response.status_code, 409)
+        execute.assert_not_called()
+        self.toy.refresh_from_db()
+        self.assertEqual(self.toy.stock, 1)
+
+    def test_indexed_aggregate(self):
+        """Reserved quantity is summed from the reservation index"""
+        if connection.vendor != "sqlite":
+            self.skipTest("Query plan differs between databases")
+        plan = Reservation.objects.filter(item__in=[self.toy.pk]).sum_by_item()
+        self.assertIn("order_reservation_item_idx", plan.explain())
+
+    def test_checkout(self):
+        """Checkout of last unit held by another order goes back to cart"""
+        Reservation.objects.reserve(self.first)
+        self.client.get(reverse("order:add-to-cart", kwargs={"slug": self.toy.slug}))
+        response = self.client.post(
+            reverse("checkout:checkout"),
+            {
+                "email": "buyer@example.com",
+                "shipping_name": "Buyer",
+                "shipping_street_address": "Street 1",
+                "shipping_city": "Ladenburg",
+                "shipping_country": "DE",
+                "shipping_zip": "68526",
+                "billing_name": "Buyer",
+                "billing_street_address": "Street 1",
+                "billing_city": "Ladenburg",
+                "billing_country": "DE",
+                "billing_zip": "68526",
+            },
+        )
+        self.assertRedirects(response, reverse("order:cart-summary"))
+        self.assertEqual(Reservation.objects.count(), 1)
@@ -5,6 +5,7 @@ from django.shortcuts import redirect, render
 from django.utils.translation import gettext_lazy as _
 from django.views.generic import ListView, View
 
+from .cart import SessionCart, get_open_cart, set_cart_count
 from .models import Order
 
 
@@ -12,31 +13,31 @@ class OrderView(View):
     """Cart summary"""
 
     def get(self, *args, **kwargs):
+        if not self.request.user.is_authenticated:
+            order, order_items = SessionCart(self.request).get_order()
+            if not order_items:
+                messages.warning(self.request, _("Your cart is empty"))
+                return redirect("/")
+            context = {"order": order, "order_items": order_items}
+            return render(self.request, "cart_summary.html", context)
         try:
             order = (
-                Order.objects.only("ordered", "user", "session_key")
-                .filter(
-                    ordered=False,
-                    user=(
-                        self.request.user
-                        if self.request.user.is_authenticated
-                        else None
-                    ),
-                    session_key=(
-                        None
-                        if self.request.user.is_authenticated
-                        else self.request.session.session_key
-                    ),
-                )
-                .prefetch_related("orderitem_set")
+                get_open_cart(self.request)
+                .only("ordered", "user", "session_key")
+                .with_totals()
+                .prefetch_related("orderitem_set__item")
                 .first()
             )
+            if not order.line_count:
+                raise IndexError
             context = {
                 "order": order,
                 "order_items": order.orderitem_set.all(),
             }
+            set_cart_count(self.request, order.line_count)
             return render(self.request, "cart_summary.html", context)
         except (IndexError, ObjectDoesNotExist, AttributeError):
+            set_cart_count(self.request, 0)
             messages.warning(self.request, _("Your cart is empty"))
             return redirect("/")
 
@@ -17,7 +17,8 @@ from django.views.generic import View
 from paypalcheckoutsdk.core import PayPalHttpClient, SandboxEnvironment
 from paypalcheckoutsdk.orders import OrdersCaptureRequest, OrdersCreateRequest
 
-from order.models import Order
+from order.cart import SessionCart, get_open_cart, set_cart_count
+from order.models import Reservation
 from .models import Payment
 
 
@@ -32,18 +33,8 @@ class PaypalView(View):
     def get(self, *args, **kwargs):
         """Get view"""
         try:
-            order = Order.objects.get(
-                ordered=False,
-                user=(
-                    self.request.user if self.request.user.is_authenticated else None
-                ),
-                session_key=(
-                    None
-                    if self.request.user.is_authenticated
-                    else self.request.session.session_key
-                ),
-            )
-            order_items = order.orderitem_set.all()
+            order = get_open_cart(self.request).with_totals().get()
+            order_items = order.orderitem_set.select_related("item")
             if not order.address:
                 messages.warning(self.request, _("You have no address for your order"))
                 return redirect("checkout:checkout")
@@ -66,21 +57,24 @@ class PaypalView(View):
             client_secret=config("PAYPAL_CLIENT_SECRET"),
         )
         client = PayPalHttpClient(environment)
+        if not self.request.user.is_authenticated:
+            # Cart may have changed in session since checkout
+            SessionCart(self.request).save_order()
         try:
-            order = Order.objects.get(
-                ordered=False,
-                user=(
-                    self.request.user if self.request.user.is_authenticated else None
-                ),
-                session_key=(
-                    None
-                    if self.request.user.is_authenticated
-                    else self.request.session.session_key
-                ),
-            )
+            order = get_open_cart(self.request).with_totals().get()
         except ObjectDoesNotExist:
             messages.warning(self.request, _("You do not have anything in your cart"))
             return redirect("core:home")
+        # Hold stock again, the hold from checkout may have expired
+        short = Reservation.objects.reserve(order)
+        if short:
+            return JsonResponse(
+                {
+                    "error": _("Not enough on stock: ")
+                    + ", ".join(item.title for item in short)
+                },
+                status=409,
+            )
         currency = "EUR"
         items_in_order = []
         for i in order.orderitem_set.all().select_related("item"):
@@ -182,14 +176,24 @@ class PaypalView(View):
 def capture(request, order_id):
     """Capturing PayPal order for succesfull transfer of cash + send email to admins and customer"""
     if request.method == "POST":
-        order = Order.objects.get(
-            ordered=False,
-            user=request.user if request.user.is_authenticated else None,
-            session_key=(
-                None if request.user.is_authenticated else request.session.session_key
-            ),
-        )
-        order_items = order.orderitem_set.all()
+        order = get_open_cart(request).with_totals().get()
+        order_items = order.orderitem_set.select_related("item")
+        # Hold may have expired while buyer was at PayPal, and its stock
+        # been held for another order since. Not charged then
+        short = Reservation.objects.reserve(order)
+        if short:
+            return JsonResponse(
+                {
+                    "details": [
+                        {
+                            "issue": "NOT_ENOUGH_STOCK",
+                            "description": _("Not enough on stock: ")
+                            + ", ".join(item.title for item in short),
+                        }
+                    ]
+                },
+                status=409,
+            )
         capture_order = OrdersCaptureRequest(order_id)
         environment = SandboxEnvironment(
             client_id=config("PAYPAL_CLIENT_ID"),
@@ -211,10 +215,9 @@ def capture(request, order_id):
             order.ref_code = create_ref_code()
             order.ordered_date = timezone.now()
             order.save()
-            for i in order_items:
-                i.item.stock -= i.quantity
-                i.item.ordered_counter += 1
-                i.item.save()
+            set_cart_count(request, 0)
+            SessionCart(request).clear()
+            Reservation.objects.take(order)
 
             #  Send mail for confirmation of order
             subject = _("Your order #") + order.ref_code
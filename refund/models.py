@@ -1,7 +1,7 @@
 from django.db import models
 from django.utils.translation import gettext as _
 
-from common.models import compress
+from common.models import ImageJob, is_image_changed
 
 
 class Refund(models.Model):
@@ -21,6 +21,8 @@ class Refund(models.Model):
         return f"{self.pk}"
 
     def save(self, *args, **kwargs):
-        if self._old_image != self.image:
-            self.image = compress(self.image)
+        image_changed = is_image_changed(self._old_image, self.image)
         super().save(*args, **kwargs)
+        if image_changed:
+            ImageJob.enqueue(self, "image")
+        self._old_image = self.image